@@ -21,13 +21,67 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
     """
 
+import functools
 import gc
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import json
+import math
+import multiprocessing.util
 import os.path
+import shutil
 import sys
+import tempfile
+import time
+import warnings
+import zlib
+from concurrent.futures import ProcessPoolExecutor, wait
 
-import pandas as pd
-import sqlalchemy as sa
-from Crypto.Hash import RIPEMD, SHA224, SHA256, SHA384, SHA512
+from hashcheckpoint import RunCheckpoint, RunLock
+from hashcompression import compression_extension, compression_of, open_compressed
+from hashdigestcache import DigestCache
+from hashinstrumentation import Progress, RunReport, available_memory, instrumented_stage
+from hashoutputwriters import CSVOutputWriter, ColumnarOutputWriter, OUTPUT_EXTENSIONS, join_columnar_parts
+from hashpipeline import BackgroundWriter, prefetch
+from hashschema import SchemaCatalog
+from lazyimport import LazyModule, optional_module
+
+# The heavy dependencies are imported on first use, which keeps the startup of short runs fast.
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+sa = LazyModule('sqlalchemy')
+RIPEMD = LazyModule('Crypto.Hash.RIPEMD')
+SHA224 = LazyModule('Crypto.Hash.SHA224')
+SHA256 = LazyModule('Crypto.Hash.SHA256')
+SHA384 = LazyModule('Crypto.Hash.SHA384')
+SHA512 = LazyModule('Crypto.Hash.SHA512')
+SHA3_224 = LazyModule('Crypto.Hash.SHA3_224')
+SHA3_256 = LazyModule('Crypto.Hash.SHA3_256')
+SHA3_384 = LazyModule('Crypto.Hash.SHA3_384')
+SHA3_512 = LazyModule('Crypto.Hash.SHA3_512')
+BLAKE2b = LazyModule('Crypto.Hash.BLAKE2b')
+BLAKE2s = LazyModule('Crypto.Hash.BLAKE2s')
+pa = optional_module('pyarrow')
+pacsv = optional_module('pyarrow.csv')
+pq = optional_module('pyarrow.parquet')
+
+# Hash formats by name (CSVCryptoHash.hstr), with the value identify_hash expects for them
+HASH_FORMATS = {'ripemd160': 1, 'sha224': 2, 'sha256': 3, 'sha384': 4, 'sha512': 5, 'blake2b': 6, 'blake2s': 7,
+                'sha3_224': 8, 'sha3_256': 9, 'sha3_384': 10, 'sha3_512': 11}
+
+# pycryptodome implementation of every hash format, used when hashlib does not provide it or is slower
+CRYPTO_HASHES = {'ripemd160': RIPEMD, 'sha224': SHA224, 'sha256': SHA256, 'sha384': SHA384, 'sha512': SHA512,
+                 'blake2b': BLAKE2b, 'blake2s': BLAKE2s, 'sha3_224': SHA3_224, 'sha3_256': SHA3_256,
+                 'sha3_384': SHA3_384, 'sha3_512': SHA3_512}
+
+# Name of the fastest implementation found for each hash format (and keyed mode), see fastest_constructor
+FASTEST_IMPLEMENTATIONS = {}
+
+# File extensions of input files that are read as Parquet rather than CSV
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
 
 
 class StringFolder(object):
@@ -91,6 +145,492 @@ def string_folding_wrapper(results):
         )
 
 
+def hashlib_constructor(hstr):
+    """
+    Return the hashlib constructor for the hash format named hstr, or None when the running
+    interpreter/OpenSSL build does not provide it. hashlib produces the same digests as pycryptodome
+    for these formats, at a much lower cost per call.
+    """
+    if hasattr(hashlib, hstr):
+        return getattr(hashlib, hstr)
+    try:
+        hashlib.new(hstr)
+    except ValueError:
+        return None
+    return functools.partial(hashlib.new, hstr)
+
+
+def crypto_constructor(hstr, key=None):
+    """
+    Return a constructor for the hash format named hstr implemented by pycryptodome. BLAKE2 formats are keyed
+    natively when a key is given; the other formats are then used as HMAC.
+    """
+    module = CRYPTO_HASHES[hstr]
+    if hstr.startswith('blake2'):
+        if key is None:
+            return lambda data=b'': module.new(data=data)
+        return lambda data=b'': module.new(data=data, key=key)
+    if key is None:
+        return module.new
+    return hmac_constructor(key, module.new)
+
+
+def keyed_constructors(hstr, key):
+    """
+    Return a dictionary of implementation name -> constructor for the keyed version of the hash format named
+    hstr: BLAKE2 in its native keyed mode, HMAC for the other formats.
+    """
+    constructors = {'pycryptodome': crypto_constructor(hstr, key)}
+    if hashlib_constructor(hstr) is not None:
+        if hstr.startswith('blake2'):
+            constructors['hashlib'] = functools.partial(getattr(hashlib, hstr), key=key)
+        else:
+            # hmac uses OpenSSL's HMAC when the digest is given by name
+            constructors['hashlib'] = hmac_constructor(key, hstr)
+    return constructors
+
+
+def hmac_constructor(key, digestmod):
+    """
+    Return a constructor of HMAC objects for key and digestmod. The key is processed once; every object is a copy
+    of the keyed template.
+    """
+    template = hmac.new(key, digestmod=digestmod)
+
+    def new(data=b''):
+        h = template.copy()
+        h.update(data)
+        return h
+    return new
+
+
+def fastest_constructor(name, constructors):
+    """
+    Return the fastest of several constructors producing the same digests (e.g. hashlib/OpenSSL and pycryptodome).
+    They are timed once per process on short values like the ones found in CSV fields.
+
+    :param name: Name of the hash format (and mode) the choice is remembered under.
+    :param constructors: Dictionary of implementation name -> constructor.
+    :return: (implementation name, constructor)
+    """
+    if name not in FASTEST_IMPLEMENTATIONS or FASTEST_IMPLEMENTATIONS[name] not in constructors:
+        values = [b'%016d' % k for k in range(2000)]
+        timings = []
+        for implementation, constructor in sorted(constructors.items()):
+            started = time.perf_counter()
+            for value in values:
+                constructor(value).hexdigest()
+            timings.append((time.perf_counter() - started, implementation))
+        FASTEST_IMPLEMENTATIONS[name] = min(timings)[1]
+    implementation = FASTEST_IMPLEMENTATIONS[name]
+    return implementation, constructors[implementation]
+
+
+def key_identifier(key):
+    """
+    Identifier of a hashing key that can be stored (digest cache, run report, manifest) without revealing the key.
+    """
+    return hmac.new(key, b'iTelliHashCSV key identifier', 'sha256').hexdigest()[:16]
+
+
+def record_boundaries(filepath, offsets, quotechar='"', start=0, blocksize=1 << 22):
+    """
+    For each of the (ascending) offsets, find the position just after the first line break at or after the
+    offset that ends a CSV record, i.e. that is not inside a quoted value. Quoted values are tracked by the
+    parity of quotechar from start onwards, which must itself be a record boundary. Offsets for which no
+    record end follows are mapped to the size of the file.
+    """
+    quote = quotechar.encode()
+    pending = [max(offset, start) for offset in sorted(offsets)]
+    boundaries = []
+    inquote = False
+    base = start
+    with open(filepath, 'rb') as handle:
+        handle.seek(start)
+        while pending:
+            block = handle.read(blocksize)
+            if not block:
+                break
+            cursor = 0
+            parity = inquote
+            while pending and pending[0] - base < len(block):
+                newline = block.find(b'\n', max(pending[0] - base, cursor))
+                if newline < 0:
+                    pending[0] = base + len(block)
+                    break
+                parity ^= bool(block.count(quote, cursor, newline) & 1)
+                cursor = newline
+                if parity:
+                    # Line break inside a quoted value, keep looking.
+                    pending[0] = base + newline + 1
+                    continue
+                boundary = base + newline + 1
+                while pending and pending[0] < boundary:
+                    pending.pop(0)
+                    boundaries.append(boundary)
+            inquote = parity ^ bool(block.count(quote, cursor) & 1)
+            base += len(block)
+    size = os.path.getsize(filepath)
+    return boundaries + [size] * len(pending)
+
+
+def split_csv_byte_ranges(filepath, nparts, quotechar='"'):
+    """
+    Split the records of a CSV file (everything after the header line) into about nparts byte ranges that
+    start and end on record boundaries, taking quoted values with embedded line breaks into account.
+
+    :return: (end of the header line, list of (start, end) byte ranges in file order)
+    """
+    headerend = record_boundaries(filepath, [0], quotechar)[0]
+    size = os.path.getsize(filepath)
+    step = (size - headerend) / float(max(1, nparts))
+    offsets = [int(headerend + step * k) for k in range(1, nparts)]
+    boundaries = [headerend] + record_boundaries(filepath, offsets, quotechar, start=headerend) + [size]
+    ranges = [(a, b) for a, b in zip(boundaries, boundaries[1:]) if b > a]
+    return headerend, ranges
+
+
+def last_record_end(filepath, start=0, quotechar='"', blocksize=1 << 22):
+    """
+    Position just after the last line break of a CSV file that ends a record (see record_boundaries), counting
+    from start, which must itself be a record boundary. A last record that is not terminated by a line break
+    (e.g. one still being appended) is not included. Returns start if there is no complete record.
+    """
+    quote = quotechar.encode()
+    end = start
+    inquote = False
+    base = start
+    with open(filepath, 'rb') as handle:
+        handle.seek(start)
+        while True:
+            block = handle.read(blocksize)
+            if not block:
+                break
+            blockend = inquote ^ bool(block.count(quote) & 1)
+            # Walk back from the end of the block to the last line break outside of a quoted value.
+            parity = blockend
+            position = len(block)
+            while True:
+                newline = block.rfind(b'\n', 0, position)
+                if newline < 0:
+                    break
+                parity ^= bool(block.count(quote, newline, position) & 1)
+                position = newline
+                if not parity:
+                    end = base + newline + 1
+                    break
+            inquote = blockend
+            base += len(block)
+    return end
+
+
+def file_fingerprint(filepath, offset, samplesize=1 << 16):
+    """
+    Fingerprint of the first offset bytes of a file, from its first and last samplesize bytes, used to
+    check that a file has only been appended to since it was last processed.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as handle:
+        digest.update(handle.read(min(offset, samplesize)))
+        handle.seek(max(0, offset - samplesize))
+        digest.update(handle.read(offset - handle.tell()))
+    return digest.hexdigest()
+
+
+def open_input(filepath):
+    """
+    Open an input file for reading as binary, decompressing it if it is compressed (see compression_of).
+    """
+    if compression_of(filepath):
+        return open_compressed(filepath)
+    return open(filepath, 'rb')
+
+
+def read_header(filepath, quotechar='"', blocksize=1 << 16):
+    """
+    First record (the header line) of a CSV file, which may be compressed, taking quoted values with embedded
+    line breaks into account.
+
+    :return: (bytes of the header line including its line break, whether any data follows it)
+    """
+    quote = quotechar.encode()
+    header = b''
+    inquote = False
+    with open_input(filepath) as handle:
+        while True:
+            block = handle.read(blocksize)
+            if not block:
+                return header, False
+            cursor = 0
+            while True:
+                newline = block.find(b'\n', cursor)
+                if newline < 0:
+                    break
+                inquote ^= bool(block.count(quote, cursor, newline) & 1)
+                cursor = newline + 1
+                if not inquote:
+                    return header + block[:cursor], cursor < len(block) or bool(handle.read(1))
+            inquote ^= bool(block.count(quote, cursor) & 1)
+            header += block
+
+
+def closing_chunks(handle, chunks):
+    """
+    Iterate over chunks read from handle, and close handle when done.
+    """
+    with handle:
+        for chunk in chunks:
+            yield chunk
+
+
+def shard_of(field, plaintext, nshards):
+    """
+    Shard (0 to nshards - 1) of a (FieldName, Plaintext) pair, from a hash that is the same in every process and on
+    every node. A missing plaintext (None) is a value of its own.
+    """
+    key = field.encode() + (b'\0' if plaintext is None else b'\1' + plaintext.encode())
+    return zlib.crc32(key) % nshards
+
+
+def plaintext_key(plaintext):
+    """
+    Sort key of a plaintext value in the order of the SQLite pipeline: NULL (None) first, then code point order.
+    """
+    return plaintext is not None, plaintext or ''
+
+
+def is_parquet(filepath):
+    """
+    Whether an input file is read as Parquet (by its file extension) rather than as CSV.
+    """
+    return isinstance(filepath, str) and filepath.lower().endswith(PARQUET_EXTENSIONS)
+
+
+class ByteRangeReader(io.RawIOBase):
+    """
+    Read-only, binary file object presenting the header line of a CSV file followed by one byte range of its
+    records, so that a range can be parsed by pandas like a complete CSV file.
+    """
+
+    def __init__(self, filepath, headerend, start, end):
+        io.RawIOBase.__init__(self)
+        self.handle = open(filepath, 'rb')
+        self.pieces = [[0, headerend], [start, end]]
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.pieces:
+            position, end = self.pieces[0]
+            if position >= end:
+                self.pieces.pop(0)
+                continue
+            self.handle.seek(position)
+            count = self.handle.readinto(memoryview(buffer)[:min(len(buffer), end - position)])
+            if not count:
+                self.pieces.pop(0)
+                continue
+            self.pieces[0][0] += count
+            return count
+        return 0
+
+    def close(self):
+        self.handle.close()
+        io.RawIOBase.close(self)
+
+
+class DigestMap(object):
+    """
+    Compact plaintext -> hash value mapping for one field/column. Instead of a dictionary of Python strings,
+    the UTF-8 encoded plaintext values are kept in one concatenated byte buffer, indexed by the start and end of
+    every value, and the raw digests in one contiguous (entries x digest size) byte array. The entries are sorted
+    by a 64 bit hash of their plaintext (see pandas.util.hash_array): values are looked up by binary search on the
+    hashes and then compared with the stored plaintext, so the memory used per entry does not depend on the
+    longest plaintext of the field. The digests are only converted to hexadecimal for the values being written.
+    """
+
+    def __init__(self, digestsize):
+        self.digestsize = digestsize
+        self.buffer = bytearray()
+        self.hashparts = []
+        self.lengthparts = []
+        self.digestparts = []
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.starts = np.zeros(0, dtype=np.int64)
+        self.ends = np.zeros(0, dtype=np.int64)
+        self.digests = np.zeros((0, digestsize), dtype=np.uint8)
+
+    @staticmethod
+    def hash_values(values):
+        """ 64 bit hashes of a list of plaintext strings. """
+        return pd.util.hash_array(np.array(values, dtype=object), categorize=False)
+
+    def add(self, plaintexts, hashvalues):
+        """ Add a batch of plaintext values and their hexadecimal hash values. finish() must be called after the
+            last batch.
+        """
+        plaintexts = list(plaintexts)
+        encoded = [p.encode() for p in plaintexts]
+        self.buffer += b''.join(encoded)
+        self.lengthparts.append(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)))
+        self.hashparts.append(self.hash_values(plaintexts))
+        self.digestparts.append(np.frombuffer(bytes.fromhex(''.join(hashvalues)),
+                                              dtype=np.uint8).reshape(-1, self.digestsize))
+
+    def finish(self):
+        """ Merge the added batches and sort them for lookup. """
+        if self.hashparts:
+            ends = np.cumsum(np.concatenate(self.lengthparts))
+            hashes = np.concatenate(self.hashparts)
+            order = np.argsort(hashes, kind='mergesort')
+            self.hashes = hashes[order]
+            self.starts = (ends - np.concatenate(self.lengthparts))[order]
+            self.ends = ends[order]
+            self.digests = np.concatenate(self.digestparts)[order]
+        self.hashparts = []
+        self.lengthparts = []
+        self.digestparts = []
+
+    def lookup(self, values):
+        """ Hash values of a column of plaintext values.
+
+        :param values: Column/Series of plaintext values; missing values (NaN) are allowed.
+        :return: List of hexadecimal hash values, None for missing or unknown values.
+        """
+        distinct = [v for v in pd.unique(values) if isinstance(v, str)]
+        hashvalues = {}
+        if distinct and len(self.hashes):
+            queries = self.hash_values(distinct)
+            positions = np.searchsorted(self.hashes, queries)
+            found = self.hashes[np.minimum(positions, len(self.hashes) - 1)] == queries
+            candidates = itertools.compress(distinct, found)
+            for value, query, position in zip(candidates, queries[found], positions[found]):
+                # Entries whose plaintexts have the same hash are next to each other
+                encoded = value.encode()
+                while position < len(self.hashes) and self.hashes[position] == query:
+                    if self.buffer[self.starts[position]:self.ends[position]] == encoded:
+                        hashvalues[value] = self.digests[position].tobytes().hex()
+                        break
+                    position += 1
+        return [hashvalues.get(v) if isinstance(v, str) else None for v in values]
+
+
+class DistinctValues(object):
+    """
+    Exact set of the distinct values of one field/column seen so far by a run, kept compact: the UTF-8 encoded
+    values are stored in sorted fixed-width numpy byte string arrays ('runs'), which are merged as they grow so
+    that only a few runs have to be searched. Missing values are tracked by a flag. Values longer than maxbytes
+    (which would widen every entry of a run) or ending with a NUL byte (which numpy strips) are not tracked, so
+    they are always reported as new.
+    """
+
+    def __init__(self, maxbytes=64):
+        self.maxbytes = maxbytes
+        self.runs = []
+        self.missing = False
+
+    def add_new(self, values):
+        """ Add distinct values (e.g. from drop_duplicates) to the set.
+
+        :param values: Column/Series of distinct plaintext values; missing values (NaN) are allowed.
+        :return: numpy boolean array, True for the values that were not in the set yet.
+        """
+        values = list(values)
+        new = np.ones(len(values), dtype=bool)
+        positions = []
+        encoded = []
+        for position, value in enumerate(values):
+            if not isinstance(value, str):
+                new[position] = not self.missing
+                self.missing = True
+                continue
+            e = value.encode()
+            if len(e) <= self.maxbytes and not e.endswith(b'\0'):
+                positions.append(position)
+                encoded.append(e)
+        if not encoded:
+            return new
+        keys = np.array(encoded, dtype=bytes)
+        found = np.zeros(len(keys), dtype=bool)
+        lengths = np.array([len(e) for e in encoded])
+        for run in self.runs:
+            # Values longer than the entries of a run cannot be present (and would be truncated by numpy)
+            candidates = np.flatnonzero(~found & (lengths <= run.itemsize))
+            if not len(candidates):
+                continue
+            queries = keys[candidates].astype(run.dtype)
+            where = np.minimum(np.searchsorted(run, queries), len(run) - 1)
+            found[candidates] = run[where] == queries
+        new[np.array(positions)[found]] = False
+        if not found.all():
+            self.runs.append(np.sort(keys[~found], kind='mergesort'))
+            # Merge the newest runs while a run is not much larger than the one after it
+            while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+                last = self.runs.pop()
+                self.runs[-1] = np.sort(np.concatenate([self.runs[-1], last]), kind='mergesort')
+        return new
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record, synchronous='OFF'):
+    """
+    Tune every connection to the temporary SQLite database: write-ahead log, large page cache and in-memory
+    temporary storage for sorting. Without checkpointing the database is rebuilt from the input files when a run
+    fails, so durability is traded for speed (synchronous OFF, no fsync). With checkpointing it must be FULL:
+    the checkpoint, which is written to disk, records the files inserted, so their rows must be on disk before
+    it; with NORMAL the last transactions in the write-ahead log can be lost by a crash of the system.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA page_size=65536')
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=' + synchronous)
+    cursor.execute('PRAGMA cache_size=-262144')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+
+class RunCancelled(Exception):
+    """
+    Raised at the next cancellation point (between chunks, files and fields/columns) once the cancelevent of a
+    CSVCryptoHash has been set.
+    """
+
+
+# CSVCryptoHash of a worker process, see _start_worker
+_worker = None
+
+
+def _start_worker(settings):
+    """
+    Initializer of the worker processes used when CSVCryptoHash.workers > 1. Builds the CSVCryptoHash, configured
+    like the one in the parent process, that runs every call of the worker process, so that the digest cache is
+    opened and read once per worker process rather than once per call.
+    """
+    global _worker
+    _worker = CSVCryptoHash()
+    _worker.apply_settings(settings)
+    # Run as the worker process exits, including when the pool shuts down (atexit handlers are not)
+    multiprocessing.util.Finalize(None, _stop_worker, exitpriority=10)
+
+
+def _stop_worker():
+    """
+    Close the digest cache of a worker process, which writes back the last use of the entries it found. The
+    parent process evicts old entries once the run is complete.
+    """
+    if _worker is not None:
+        _worker.close_digest_cache(evict=False)
+
+
+def _run_in_worker(methodname, *args):
+    """
+    Entry point of the worker processes used when CSVCryptoHash.workers > 1: calls the given method on the
+    CSVCryptoHash of the worker process (see _start_worker).
+    """
+    # Measurements are sent back with the result, see map_in_pool.
+    return getattr(_worker, methodname)(*args), _worker.report.take_pending()
+
+
 class CSVCryptoHash(object):
     """
     Logic for hashing selected fields/columns selected by the user from CSV input file(s) selected by the
@@ -98,9 +638,18 @@ class CSVCryptoHash(object):
 
     """
 
-    def __init__(self):
-        self.hstr = 'sha512'
-        self.h = SHA512.new()
+    # Settings copied into the worker processes, see worker_settings.
+    worker_attributes = ('quotechar', 'inputdelimiter', 'outputdelimiter', 'delim_whitespace', 'chunksize',
+                         'chunkbytes', 'splitbytes', 'csvengine', 'outputformat', 'columnarcompression',
+                         'outputcompression', 'compressionthreads', 'compressionlevel', 'cachepath',
+                         'cachemaxentries', 'cachemaxage', 'cachemode', 'pipelinedepth')
+
+    def __init__(self, workers=1):
+        # Secret key (bytes) for keyed hashing: BLAKE2 formats use their keyed mode and the other formats HMAC, so
+        # that values from small domains (SSNs, dates of birth...) cannot be recovered by hashing every candidate.
+        # Must be set before identify_hash.
+        self.hashkey = None
+        self.identify_hash(5)
         self.files2process = []
         self.fields2encrypt = []
         self.fields2process = []
@@ -116,36 +665,733 @@ class CSVCryptoHash(object):
         self.inputdirectory = ''
         self.outputdirectory = ''
 
-    def initialize_sqlite(self):
-        self.SQLiteconnection = sa.create_engine('sqlite:///source.db')
+        # Streaming mode for create_hashed_version_of_input. Set chunksize to a number of rows, or chunkbytes to an
+        # approximate number of input bytes, to process each input file in chunks of that size. When both are None
+        # each input file is read into memory in one piece.
+        self.chunksize = None
+        self.chunkbytes = None
 
-    @staticmethod
-    def remove_sqlite():
-        os.remove('source.db')
+        # Use create_outputs_single_pass (one read per input file, no SQLite round trip) instead of the four stage
+        # pipeline built around the temporary SQLite database.
+        self.singlepass = False
+
+        # Number of worker processes the input files are spread across. 1 processes everything in this process.
+        self.workers = workers
+        # With workers > 1, input files larger than this many bytes are split into byte ranges on record boundaries
+        # that are processed in parallel as well. None disables splitting.
+        self.splitbytes = 256 << 20
+
+        # Optional persistent plaintext -> digest cache (see hashdigestcache.DigestCache) shared by all runs. Set
+        # cachepath to enable it; entries beyond cachemaxentries or unused for cachemaxage seconds are evicted when
+        # the cache is closed. With cachemode 'auto' the cache is only used for the HMAC formats, for which a cache
+        # hit costs less than hashing the value (see cache_pays_off); with 'always' it is used for all of them.
+        self.cachepath = None
+        self.cachemaxentries = None
+        self.cachemaxage = None
+        self.cachemode = 'auto'
+        self.digestcache = None
+
+        # CSV reader used for the input files: 'c' (pandas C parser), 'mmap' (pandas C parser reading a memory
+        # mapped file) or 'pyarrow' (multi-threaded pyarrow reader, requires pyarrow). All of them read the same
+        # values; whitespace delimited files are always read with the pandas C parser.
+        self.csvengine = 'c'
+
+        # Format of the hashed files and 'mapfiles': 'csv', or 'parquet' / 'arrow' (Arrow IPC file), which store hash
+        # values as fixed-size binary digests and are compressed with columnarcompression. Both require pyarrow.
+        self.outputformat = 'csv'
+        self.columnarcompression = 'zstd'
+
+        # Compression of csv output files: None, 'gzip', 'bz2', 'xz' or 'zstd'. Output is compressed in blocks on
+        # compressionthreads threads (default: one per CPU), overlapping with hashing. Compressed input files
+        # (.gz, .bz2, .xz, .zst) are always read directly, decompressed on a background thread.
+        self.outputcompression = None
+        self.compressionthreads = None
+        self.compressionlevel = None
+
+        # Number of rows written at a time by write_sorted_rows.
+        self.writebatchsize = 100000
+
+        # Reading (and parsing) the next chunk, hashing the current one and writing the previous one overlap on
+        # separate threads, with at most pipelinedepth chunks waiting between two of them (see hashpipeline).
+        # 0 runs them one after the other.
+        self.pipelinedepth = 2
+
+        # Incremental mode (see create_outputs_incremental): only rows appended to the input files, and new input
+        # files, are processed. What has already been processed is recorded in a manifest next to the outputs.
+        self.incremental = False
+
+        # Measurements of the current run (see hashinstrumentation.RunReport), written by write_run_report. Profiler
+        # hooks such as hashinstrumentation.CProfileHook can be added to report.hooks.
+        self.report = RunReport()
+
+        # Progress of the current run (see hashinstrumentation.Progress). Set progress.callback to a function
+        # taking a dictionary to be told about it.
+        self.progress = Progress()
+
+        # Column names (and sniffed dialects) of the input files, each read once per run and shared by all stages
+        # (see hashschema.SchemaCatalog).
+        self.catalog = SchemaCatalog(self.header_columns, self.reading_settings)
+
+        # Cooperative cancellation: set cancelevent to a threading.Event; once it is set the run stops with
+        # RunCancelled at the next chunk, file or field/column. With checkpointing, the SQLite pipeline records its
+        # completed stages, files and fields in a checkpoint next to the temporary database, which are both kept
+        # when a run is cancelled, so that starting the same run again resumes after the last completed step. The
+        # database is locked by the run using it (runlock, see open_checkpoint).
+        self.cancelevent = None
+        self.checkpointing = False
+        self.checkpoint = None
+        self.runlock = None
+
+        # Temporary SQLite database of the four stage pipeline, private to each run: 'disk' (a new file in
+        # scratchdirectory, by default the system temporary directory; a tmpfs or local SSD is best), 'memory', or
+        # 'auto': in memory when the estimated size of the data table (see estimate_store_bytes) is below
+        # memorystorelimit bytes, by default half of the available memory. Checkpointed runs always use a file.
+        self.tempstore = 'auto'
+        self.scratchdirectory = None
+        self.memorystorelimit = None
+        self.databasepath = None
+
+    def initialize_sqlite(self, databasepath=None):
+        """ Create the temporary SQLite database: in memory when tempstore is 'memory', otherwise in a new file in
+            the scratch directory so that concurrent runs never share it. The data table has one row per distinct
+            (FieldName, Plaintext) pair, enforced by a unique index so that duplicates are dropped as they are
+            inserted.
+
+        :param databasepath: Path of the database file to use (and reuse if it exists) instead of a new one.
+        :return: No explicit value returned. self.SQLiteconnection set for further processing.
+        """
+        if databasepath is None and self.tempstore == 'memory':
+            # One connection shared by all threads (the GUI creates the database and its worker thread fills it)
+            self.databasepath = None
+            self.SQLiteconnection = sa.create_engine('sqlite://', poolclass=sa.pool.StaticPool,
+                                                     connect_args={'check_same_thread': False})
+        else:
+            if databasepath is None:
+                handle, databasepath = tempfile.mkstemp(prefix='itellihashcsv-', suffix='.db',
+                                                        dir=self.scratch_directory())
+                os.close(handle)
+            self.databasepath = databasepath
+            self.SQLiteconnection = sa.create_engine('sqlite:///' + databasepath)
+        synchronous = 'FULL' if self.checkpointing else 'OFF'
+        sa.event.listen(self.SQLiteconnection, 'connect',
+                        lambda dbapi_connection, connection_record: set_sqlite_pragmas(dbapi_connection,
+                                                                                       connection_record, synchronous))
+        with self.SQLiteconnection.begin() as connection:
+            connection.execute(sa.text('CREATE TABLE IF NOT EXISTS data (Hashvalue TEXT, Plaintext TEXT, '
+                                       'FieldName TEXT)'))
+            connection.execute(sa.text('CREATE UNIQUE INDEX IF NOT EXISTS data_fieldname_plaintext '
+                                       'ON data (FieldName, Plaintext)'))
+
+    def index_sqlite(self):
+        """ Index the loaded data table for the per field/column queries ordered by Hashvalue. Creating the index
+            once the table has been loaded is cheaper than maintaining it during the inserts.
+
+        :return: No explicit value returned.
+        """
+        with self.SQLiteconnection.begin() as connection:
+            connection.execute(sa.text('CREATE INDEX IF NOT EXISTS data_fieldname_hashvalue '
+                                       'ON data (FieldName, Hashvalue, Plaintext)'))
+
+    def insert_sqlite(self, compositefiles):
+        """ Insert hashed values into the data table in one transaction, ignoring (FieldName, Plaintext) pairs
+            that are already present.
+
+        :param compositefiles: List of DataFrames with columns Hashvalue, Plaintext, FieldName.
+        :return: No explicit value returned.
+        """
+        connection = self.SQLiteconnection.raw_connection()
+        try:
+            cursor = connection.cursor()
+            for compositefile in compositefiles:
+                rows = ((hashvalue, plaintext if isinstance(plaintext, str) else None, field) for
+                        hashvalue, plaintext, field in
+                        compositefile[['Hashvalue', 'Plaintext', 'FieldName']].itertuples(index=False, name=None))
+                cursor.executemany('INSERT OR IGNORE INTO data (Hashvalue, Plaintext, FieldName) VALUES (?, ?, ?)',
+                                   rows)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def close_sqlite(self):
+        """ Close the temporary SQLite database, keeping it (and its checkpoint) so that the run can be resumed.
+            A database that cannot be resumed, i.e. that is not locked by this run (see open_checkpoint), is
+            removed.
+
+        :return: No explicit value returned.
+        """
+        if self.runlock is None:
+            self.remove_sqlite()
+            return
+        self.dispose_sqlite()
+        self.runlock.release()
+        self.runlock = None
+
+    def dispose_sqlite(self):
+        """ Close the connections to the temporary SQLite database. """
+        if getattr(self, 'SQLiteconnection', None) is not None:
+            self.SQLiteconnection.dispose()
+            self.SQLiteconnection = None
+        self.checkpoint = None
+        gc.collect()
+
+    def remove_sqlite(self):
+        self.dispose_sqlite()
+        if self.databasepath is not None:
+            for suffix in ('', '-wal', '-shm', '.checkpoint'):
+                if os.path.exists(self.databasepath + suffix):
+                    os.remove(self.databasepath + suffix)
+            self.databasepath = None
+        if self.runlock is not None:
+            self.runlock.release(remove=True)
+            self.runlock = None
         gc.collect()
 
+    def scratch_directory(self):
+        """ Directory of the temporary SQLite database files (see tempstore), created if needed. """
+        directory = self.scratchdirectory or tempfile.gettempdir()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return directory
+
+    def estimate_store_bytes(self, files2process, fields2hash, inputdirectory):
+        """ Rough upper bound of the size of the data table and its indexes, assuming that every value of the
+            selected fields/columns is distinct. The number of rows is estimated from the average length of the
+            rows at the start of each file, and from a 4:1 compression ratio for compressed files.
+
+        :param files2process: List containing the input CSV files selected for processing.
+        :param fields2hash: List containing the fields/columns selected for processing.
+        :param inputdirectory: Location of CSV input file(s)
+        :return: Number of bytes.
+        """
+        total = 0
+        for file in files2process:
+            filepath = inputdirectory + file
+            columns = self.catalog.columns(filepath)
+            fields = self.catalog.fields(filepath, fields2hash)
+            if not fields:
+                continue
+            rowbytes = self.average_row_bytes(filepath)
+            if is_parquet(filepath):
+                rows = pq.ParquetFile(filepath).metadata.num_rows
+            else:
+                rows = os.path.getsize(filepath) * (4 if compression_of(filepath) else 1) / rowbytes
+            for field in fields:
+                entrybytes = rowbytes / len(columns) + 2 * self.hashnew().digest_size + len(field)
+                # The table and its two indexes each hold (most of) every entry
+                total += int(3 * rows * entrybytes)
+        return total
+
+    def select_temp_store(self, files2process, fields2hash, inputdirectory):
+        """ Move the new, still empty temporary SQLite database where this run needs it: to the database of an
+            interrupted run being resumed (see open_checkpoint), or into memory when tempstore is 'auto' and the
+            estimated size of the data table fits in memorystorelimit.
+
+        :return: No explicit value returned.
+        """
+        if self.checkpointing:
+            self.open_checkpoint(files2process, fields2hash, inputdirectory)
+            return
+        if self.tempstore != 'auto' or self.databasepath is None:
+            return
+        limit = self.memorystorelimit
+        if limit is None:
+            available = available_memory()
+            limit = 0 if available is None else available // 2
+        if self.estimate_store_bytes(files2process, fields2hash, inputdirectory) <= limit:
+            self.remove_sqlite()
+            self.tempstore = 'memory'
+            try:
+                self.initialize_sqlite()
+            finally:
+                self.tempstore = 'auto'
+
+    def check_cancelled(self):
+        """ Cancellation point: raise RunCancelled if the cancelevent has been set.
+
+        :return: No explicit value returned.
+        """
+        if self.cancelevent is not None and self.cancelevent.is_set():
+            raise RunCancelled('Run cancelled')
+
+    def open_checkpoint(self, files2process, fields2hash, inputdirectory):
+        """ Open the checkpoint of the SQLite pipeline (see hashcheckpoint.RunCheckpoint) when checkpointing is
+            enabled. A checkpoint left by an interrupted run is resumed when the settings, fields and input files
+            (by size and modification time) are unchanged; otherwise the data table is emptied and the run starts
+            afresh. The database and checkpoint are locked (see hashcheckpoint.RunLock) while the run uses them;
+            when another run with the same identity holds the lock, this run uses a private database without a
+            checkpoint instead, which cannot be resumed.
+
+        :param files2process: List containing the input CSV files selected for processing.
+        :param fields2hash: List containing the fields/columns selected for processing.
+        :param inputdirectory: Location of CSV input file(s)
+        :return: No explicit value returned. self.checkpoint set, or None when checkpointing is disabled.
+        """
+        self.checkpoint = None
+        if not self.checkpointing:
+            return
+        settings = self.run_settings()
+        files = []
+        for file in files2process:
+            status = os.stat(inputdirectory + file)
+            files.append([file, status.st_size, status.st_mtime_ns])
+        identity = {'settings': settings, 'fields': sorted(fields2hash), 'inputdirectory': inputdirectory,
+                    'files': files}
+        # The database (and checkpoint) of a run are named after its identity, so that the same run finds them
+        databasepath = os.path.join(self.scratch_directory(), 'itellihashcsv-%s.db' % hashlib.sha256(
+            json.dumps(identity, sort_keys=True).encode()).hexdigest()[:24])
+        if databasepath != self.databasepath:
+            runlock = RunLock(databasepath + '.lock')
+            self.remove_sqlite()
+            if not runlock.acquire():
+                self.initialize_sqlite()
+                return
+            self.runlock = runlock
+            self.initialize_sqlite(databasepath)
+        self.checkpoint = RunCheckpoint(databasepath + '.checkpoint', identity)
+        if not self.checkpoint.resumed:
+            with self.SQLiteconnection.begin() as connection:
+                connection.execute(sa.text('DROP INDEX IF EXISTS data_fieldname_hashvalue'))
+                connection.execute(sa.text('DELETE FROM data'))
+
+    def step_done(self, stage, item=None):
+        """ Whether a stage (or a file/field of it) was completed by the interrupted run being resumed. """
+        return self.checkpoint is not None and self.checkpoint.done(stage, item)
+
+    def mark_done(self, stage, item=None):
+        """ Record the completion of a stage (or of a file/field of it) in the checkpoint, if any. """
+        if self.checkpoint is not None:
+            self.checkpoint.mark(stage, item)
+
+    def write_run_report(self, outputdirectory, **info):
+        """ Write the measurements of the run (see hashinstrumentation.RunReport) to
+            Hash_RunReport_<hash format chosen>.json in the output directory and start a new report.
+
+        :param outputdirectory: Location for output files
+        :param info: Additional information to include in the report (files, fields...).
+        :return: Path of the report.
+        """
+        path = outputdirectory + 'Hash_RunReport_' + self.hstr + '.json'
+        settings = self.run_settings()
+        settings.update(singlepass=self.singlepass, incremental=self.incremental,
+                        hashimplementation=self.hashimplementation, tempstore=self.tempstore,
+                        scratchdirectory=self.scratchdirectory)
+        self.report.write(path, hstr=self.hstr, settings=settings, **info)
+        self.report = RunReport(self.report.hooks)
+        self.catalog.clear()
+        return path
+
+    def cache_pays_off(self):
+        """ Whether cachemode 'auto' uses the digest cache for the hash format in use. Plain and keyed BLAKE2
+            digests of short values are cheaper to compute again than to read from the cache; HMAC digests, which
+            hash every value twice, are not (see itellihashbench --cache). The choice only depends on the hash
+            format, so that every run with the same settings uses the cache, and keeps its entries in use, or not.
+        """
+        return self.hstr.startswith('hmac_')
+
+    def open_digest_cache(self):
+        """ The persistent digest cache, opened on first use, or None when no cachepath has been set or when with
+            cachemode 'auto' the cache does not pay off for the hash format in use.
+        """
+        if self.cachepath is None or (self.cachemode == 'auto' and not self.cache_pays_off()):
+            return None
+        if self.digestcache is None:
+            self.digestcache = DigestCache(self.cachepath, self.cachemaxentries, self.cachemaxage)
+        return self.digestcache
+
+    def close_digest_cache(self, evict=True):
+        """ Evict old entries from, and close, the persistent digest cache if it has been opened.
+
+        :param evict: Whether to evict old entries; worker processes leave it to the parent process.
+        """
+        if self.digestcache is not None:
+            if evict:
+                self.digestcache.evict()
+            self.digestcache.close()
+            self.digestcache = None
+
+    def worker_settings(self):
+        """ Settings needed to configure a CSVCryptoHash in a worker process like this one.
+
+        :return: Dictionary for apply_settings.
+        """
+        settings = dict((name, getattr(self, name)) for name in self.worker_attributes)
+        settings['hash2use'] = self.hash2use
+        settings['hashkey'] = self.hashkey
+        return settings
+
+    def run_settings(self):
+        """ Settings describing the run, for the run report and checkpoint: worker_settings with the secret
+            hashkey replaced by its keyid.
+
+        :return: Dictionary that can be stored as JSON.
+        """
+        settings = self.worker_settings()
+        del settings['hashkey']
+        settings.update(keyid=self.keyid, workers=self.workers)
+        return settings
+
+    def apply_settings(self, settings):
+        """ Configure this object from a dictionary created by worker_settings.
+
+        :param settings: Dictionary created by worker_settings.
+        :return: No explicit value returned.
+        """
+        for name in self.worker_attributes:
+            setattr(self, name, settings[name])
+        self.hashkey = settings['hashkey']
+        self.identify_hash(settings['hash2use'])
+
+    def map_files(self, methodname, calls):
+        """ Call a CSVCryptoHash method once per input file. The calls are spread across a pool of worker
+            processes when workers > 1.
+
+        :param methodname: Name of the CSVCryptoHash method to call.
+        :param calls: List containing one tuple of arguments per call.
+        :return: Iterator over the results, in the same order as calls.
+        """
+        if self.workers <= 1 or len(calls) <= 1:
+            method = getattr(self, methodname)
+            return (method(*args) for args in calls)
+        return self.map_in_pool(methodname, calls)
+
+    def map_in_pool(self, methodname, calls):
+        """ See map_files. Results are yielded in submission order, so merging them is deterministic. """
+        # The parent process opens the digest cache too, so that close_digest_cache evicts old entries once the
+        # worker processes have used it.
+        self.open_digest_cache()
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(calls)), initializer=_start_worker,
+                                 initargs=(self.worker_settings(),)) as pool:
+            futures = [pool.submit(_run_in_worker, methodname, *args) for args in calls]
+            for future in futures:
+                # Wait in short slices so that a cancellation is noticed while the worker processes are busy
+                while not wait([future], timeout=0.2).done:
+                    if self.cancelevent is not None and self.cancelevent.is_set():
+                        for pending in futures:
+                            pending.cancel()
+                        self.check_cancelled()
+                result, measurements = future.result()
+                self.report.merge(measurements)
+                self.progress.advance(sum(m.get('bytes', 0) for m in measurements['files'].values()),
+                                      sum(m.get('rows', 0) for m in measurements['files'].values()))
+                yield result
+
+    def read_csv(self, filepath, **kwargs):
+        """ Read a CSV input file (or part of it) with the quoting and delimiter settings chosen by the user.
+            All values are read as strings.
+
+        :param filepath: Path (or binary file object) of the CSV input file, which may be compressed.
+        :param kwargs: Additional keyword arguments passed through to pandas.read_csv (usecols, nrows, chunksize...).
+        :return: DataFrame, or an iterator of DataFrames when chunksize is given.
+        """
+        if is_parquet(filepath):
+            return self.read_parquet(filepath, **kwargs)
+        if compression_of(filepath) and (self.delim_whitespace or self.csvengine != 'pyarrow'):
+            handle = open_input(filepath)
+            if kwargs.get('chunksize') is None:
+                with handle:
+                    return self.read_csv(handle, **kwargs)
+            return closing_chunks(handle, self.read_csv(handle, **kwargs))
+        if self.delim_whitespace:
+            return pd.read_csv(filepath, dtype=object, quotechar=self.quotechar,
+                               delim_whitespace=self.delim_whitespace, **kwargs)
+        if self.csvengine == 'pyarrow':
+            return self.read_csv_arrow(filepath, None, **kwargs)
+        if self.csvengine == 'mmap' and isinstance(filepath, str):
+            kwargs['memory_map'] = True
+        return pd.read_csv(filepath, dtype=object, quotechar=self.quotechar, delimiter=self.inputdelimiter, **kwargs)
+
+    def header_columns(self, filepath):
+        """ Column names of an input file, read from its header (see catalog, which caches them). """
+        return list(self.read_csv(filepath, nrows=0).columns)
+
+    def reading_settings(self):
+        """ Settings the column names read from an input file depend on. """
+        return self.inputdelimiter, self.quotechar, self.delim_whitespace, self.csvengine
+
+    def sniffed_dialect(self, filepaths):
+        """ Dialect sniffed from the CSV input files (see hashschema.sniff_dialect). Parquet input files are
+            ignored.
+
+        :param filepaths: Paths of the input files.
+        :return: (delimiter, quotechar), or None when there is no CSV input file.
+        """
+        dialects = set(self.catalog.dialect(filepath) for filepath in filepaths if not is_parquet(filepath))
+        if len(dialects) > 1:
+            raise ValueError('The input files do not all use the same delimiter and quote character')
+        return dialects.pop() if dialects else None
+
+    def detect_dialect(self, filepaths):
+        """ Set inputdelimiter and quotechar to the dialect sniffed from the CSV input files (see sniffed_dialect).
+
+        :param filepaths: Paths of the input files.
+        :return: (delimiter, quotechar)
+        """
+        dialect = self.sniffed_dialect(filepaths)
+        if dialect is not None:
+            self.inputdelimiter, self.quotechar = dialect
+        return self.inputdelimiter, self.quotechar
+
+    @staticmethod
+    def read_parquet(filepath, usecols=None, nrows=None, chunksize=None):
+        """ read_csv implementation for Parquet input files. Values are converted to strings, like the values read
+            from CSV input files, and nulls become missing values (NaN).
+
+        :param filepath: Path of the Parquet input file.
+        :param usecols: Columns to read, or None for all columns.
+        :param nrows: Number of rows to read, or None for all rows.
+        :param chunksize: Number of rows per DataFrame to return an iterator, or None to return one DataFrame.
+        :return: DataFrame, or an iterator of DataFrames when chunksize is given.
+        """
+        if pq is None:
+            raise ImportError('Parquet input files require the pyarrow package')
+        parquetfile = pq.ParquetFile(filepath)
+        names = parquetfile.schema_arrow.names
+        columns = names if usecols is None else [name for name in names if name in set(usecols)]
+
+        def to_frame(batch):
+            arrays = [c if c.type == pa.string() else c.cast(pa.string()) for c in batch.columns]
+            return pa.Table.from_arrays(arrays, names=columns).to_pandas().replace({None: np.nan})
+
+        def frames():
+            remaining = nrows
+            empty = True
+            for batch in parquetfile.iter_batches(batch_size=chunksize or 65536, columns=columns):
+                if remaining is not None:
+                    batch = batch.slice(0, remaining)
+                    remaining -= batch.num_rows
+                empty = False
+                yield to_frame(batch)
+                if remaining == 0:
+                    break
+            if empty:
+                yield pd.DataFrame(columns=columns, dtype=object)
+
+        if chunksize is None:
+            return pd.concat(list(frames()), ignore_index=True)
+        return frames()
+
+    def read_csv_arrow(self, filepath, byterange=None, usecols=None, nrows=None, chunksize=None):
+        """ read_csv implementation for csvengine 'pyarrow'. Only the columns in usecols are converted to Python
+            values, and values are read as strings with the same missing values (NaN) as the pandas parser.
+
+        :param filepath: Path of the CSV input file.
+        :param byterange: None for the whole file, or the part of the file to read (see input_ranges).
+        :param usecols: Columns to read, or None for all columns.
+        :param nrows: Number of rows to read, or None for all rows.
+        :param chunksize: Number of rows per DataFrame to return an iterator, or None to return one DataFrame.
+        :return: DataFrame, or an iterator of DataFrames when chunksize is given.
+        """
+        if pacsv is None:
+            raise ImportError("csvengine 'pyarrow' requires the pyarrow package")
+        from pandas._libs.parsers import STR_NA_VALUES
+
+        parseoptions = pacsv.ParseOptions(delimiter=self.inputdelimiter, quote_char=self.quotechar,
+                                          double_quote=True, newlines_in_values=True)
+        # Take the column names from the header line alone, the rest of the file may not be complete.
+        if byterange is None:
+            header, more = read_header(filepath, self.quotechar)
+        else:
+            with open(filepath, 'rb') as handle:
+                header = handle.read(byterange[0])
+            more = byterange[2] > byterange[0]
+        # pandas parses the header line, so that the names are the same as with the other engines: without a byte
+        # order mark, 'Unnamed: <n>' for empty names and '<name>.<n>' for repeated ones.
+        names = list(pd.read_csv(io.BytesIO(header), dtype=object, quotechar=self.quotechar,
+                                 delimiter=self.inputdelimiter, nrows=0).columns)
+        columns = names if usecols is None else [name for name in names if name in set(usecols)]
+        convertoptions = pacsv.ConvertOptions(column_types=dict((name, pa.string()) for name in names),
+                                              include_columns=columns, null_values=sorted(STR_NA_VALUES),
+                                              strings_can_be_null=True, quoted_strings_can_be_null=True)
+        readoptions = pacsv.ReadOptions(column_names=names, skip_rows=1)
+
+        def batches():
+            if not more:
+                # Nothing but the header line
+                yield []
+                return
+            if byterange is not None:
+                source = io.BufferedReader(ByteRangeReader(filepath, *byterange), 1 << 20)
+            else:
+                source = open_input(filepath)
+            with source, pacsv.open_csv(source, read_options=readoptions, parse_options=parseoptions,
+                                        convert_options=convertoptions) as reader:
+                remaining = nrows
+                rows = []
+                count = 0
+                for batch in reader:
+                    if remaining is not None:
+                        batch = batch.slice(0, remaining)
+                        remaining -= batch.num_rows
+                    rows.append(batch)
+                    count += batch.num_rows
+                    if chunksize is not None and count >= chunksize:
+                        yield rows
+                        rows = []
+                        count = 0
+                    if remaining == 0:
+                        break
+                if rows or chunksize is None:
+                    yield rows
+
+        def to_frame(rows):
+            table = pa.Table.from_batches(rows, schema=pa.schema([(name, pa.string()) for name in columns]))
+            return table.to_pandas().replace({None: np.nan})
+
+        def frames():
+            returned = 0
+            try:
+                for rows in batches():
+                    frame = to_frame(rows)
+                    yield frame
+                    returned += len(frame)
+                return
+            except pa.ArrowInvalid:
+                # pyarrow rejects rows with fewer values than the header, which pandas fills with missing values
+                # (NaN): the rest of the rows is read again by pandas.
+                pass
+            for frame in pandas_frames():
+                skipped = min(returned, len(frame))
+                returned -= skipped
+                if skipped < len(frame) or chunksize is None:
+                    yield frame.iloc[skipped:].reset_index(drop=True)
+
+        def pandas_frames():
+            if byterange is not None:
+                source = io.BufferedReader(ByteRangeReader(filepath, *byterange), 1 << 20)
+            else:
+                source = open_input(filepath)
+            with source:
+                reader = pd.read_csv(source, dtype=object, quotechar=self.quotechar, delimiter=self.inputdelimiter,
+                                     usecols=usecols, nrows=nrows, chunksize=chunksize)
+                for frame in [reader] if chunksize is None else reader:
+                    yield frame
+
+        if chunksize is None:
+            frame, = frames()
+            return frame
+        return frames()
+
+    def read_input(self, filepath, byterange=None, **kwargs):
+        """ Like read_csv, but reads only the records in byterange when one is given (see input_ranges).
+
+        :param filepath: Path of the CSV input file.
+        :param byterange: None, or (end of header line, start, end) as returned by input_ranges.
+        :param kwargs: Additional keyword arguments passed through to read_csv.
+        :return: DataFrame, or an iterator of DataFrames when chunksize is given.
+        """
+        if byterange is None:
+            return self.read_csv(filepath, **kwargs)
+        if self.csvengine == 'pyarrow' and not self.delim_whitespace:
+            return self.read_csv_arrow(filepath, byterange, **kwargs)
+        return self.read_csv(io.BufferedReader(ByteRangeReader(filepath, *byterange), 1 << 20), **kwargs)
+
+    def input_ranges(self, filepath):
+        """ Parts an input file is processed in. Files are only split when worker processes are used and the file
+            is larger than splitbytes; they are then split in at least one part per worker.
+
+        :param filepath: Path of the CSV input file.
+        :return: [None] for the whole file, or a list of (end of header line, start, end) byte ranges.
+        """
+        if self.workers <= 1 or self.splitbytes is None or is_parquet(filepath) or compression_of(filepath):
+            return [None]
+        size = os.path.getsize(filepath)
+        if size <= self.splitbytes:
+            return [None]
+        nparts = max(self.workers, int(math.ceil(size / float(self.splitbytes))))
+        headerend, ranges = split_csv_byte_ranges(filepath, nparts, self.quotechar)
+        if len(ranges) <= 1:
+            return [None]
+        return [(headerend, start, end) for start, end in ranges]
+
+    def rows_per_chunk(self, filepath):
+        """ Number of rows to read per chunk in streaming mode. chunksize is used as is; a chunkbytes budget is
+            converted to rows from the average length of the (decompressed) lines at the start of the file.
+
+        :param filepath: Path of the CSV input file.
+        :return: Number of rows per chunk.
+        """
+        if self.chunksize is not None:
+            return max(1, int(self.chunksize))
+        return max(1, int(self.chunkbytes / self.average_row_bytes(filepath)))
+
+    @staticmethod
+    def average_row_bytes(filepath):
+        """ Average (uncompressed) length of the rows of an input file, from the lines at the start of CSV files.
+
+        :param filepath: Path of the input file.
+        :return: Number of bytes, at least 1.
+        """
+        if is_parquet(filepath):
+            metadata = pq.ParquetFile(filepath).metadata
+            size = sum(metadata.row_group(k).total_byte_size for k in range(metadata.num_row_groups))
+            return max(1.0, size / float(max(1, metadata.num_rows)))
+        with open_input(filepath) as handle:
+            sample = handle.read(1 << 20)
+        return max(1.0, len(sample) / float(max(1, sample.count(b'\n'))))
+
+    def file_progress(self, filepath, byterange=None):
+        """ hashinstrumentation.FileProgress of reading an input file (or the part of it in byterange). Progress
+            within plain CSV files is estimated from the rows read; other files report progress once done.
+
+        :param filepath: Path of the input file.
+        :param byterange: None for the whole file, or the part of the file read (see input_ranges).
+        :return: FileProgress
+        """
+        rowbytes = 0
+        if self.progress.callback is not None and not is_parquet(filepath) and not compression_of(filepath):
+            rowbytes = self.average_row_bytes(filepath)
+        return self.progress.file(self.input_bytes(filepath, byterange), rowbytes)
+
+    def start_file_progress(self, files2process, inputdirectory):
+        """ Start the progress of a stage that reads the input files.
+
+        :param files2process: Input file(s) read by the stage.
+        :param inputdirectory: Location of input file(s)
+        :return: No explicit value returned.
+        """
+        self.progress.start(totalbytes=sum(self.input_bytes(inputdirectory + file) for file in files2process))
+
+    def start_mapfile_progress(self):
+        """ Start the progress of a stage that writes 'mapfiles' from the SQLite DB.
+
+        :return: No explicit value returned.
+        """
+        if self.progress.callback is not None:
+            with self.SQLiteconnection.connect() as connection:
+                self.progress.start(totalrows=connection.execute(sa.text('SELECT COUNT(*) FROM data')).scalar())
+
     def identify_hash(self, hash2use):
-        """ Identify type of cryptographic hashing to use for processing.
+        """ Identify type of cryptographic hashing to use for processing. The fastest implementation of the
+            chosen format (hashlib/OpenSSL or pycryptodome) is selected. When hashkey is set, the keyed version of
+            the format is used and hstr is prefixed with 'keyed_' (BLAKE2) or 'hmac_' (other formats).
 
-        :param hash2use: Value indicating type of hashing desired based upon user's input
+        :param hash2use: Value indicating type of hashing desired based upon user's input (see HASH_FORMATS)
         :return: No explicit value returned. Variables set for further processing.
 
         """
-        if hash2use == 1:
-            self.h = RIPEMD.new()
-            self.hstr = 'ripemd160'
-        elif hash2use == 2:
-            self.h = SHA224.new()
-            self.hstr = 'sha224'
-        elif hash2use == 3:
-            self.h = SHA256.new()
-            self.hstr = 'sha256'
-        elif hash2use == 4:
-            self.h = SHA384.new()
-            self.hstr = 'sha384'
-        elif hash2use == 5:
-            self.h = SHA512.new()
-            self.hstr = 'sha512'
+        names = dict((value, name) for name, value in HASH_FORMATS.items())
+        if hash2use not in names:
+            return
+        self.hash2use = hash2use
+        name = names[hash2use]
+        if self.hashkey is None:
+            self.hstr = name
+            self.keyid = None
+            constructors = {'pycryptodome': crypto_constructor(name)}
+            if hashlib_constructor(name) is not None:
+                constructors['hashlib'] = hashlib_constructor(name)
+        else:
+            maxkey = {'blake2b': 64, 'blake2s': 32}.get(name)
+            if maxkey is not None and len(self.hashkey) > maxkey:
+                raise ValueError('%s keys are at most %d bytes long' % (name, maxkey))
+            self.hstr = ('keyed_' if maxkey else 'hmac_') + name
+            self.keyid = key_identifier(self.hashkey)
+            constructors = keyed_constructors(name, self.hashkey)
+        self.hashimplementation, self.hashnew = fastest_constructor(self.hstr, constructors)
+        self.h = self.hashnew()
+
+        # The persistent digest cache must not mix digests computed with different keys
+        self.digestname = self.hstr if self.keyid is None else self.hstr + ':' + self.keyid
 
     def hash_text(self, desired_column):
         """ Hash individual fields/columns.
@@ -154,11 +1400,41 @@ class CSVCryptoHash(object):
         :return: self.hashed_value: Hashed value of field/column processed
 
         """
-        h = self.h.new()
+        h = self.hashnew()
         self.hashvalue = h.update(str.encode(str(desired_column)))
         self.hashed_value = h.hexdigest()
         return self.hashed_value
 
+    def hash_many(self, values):
+        """ Hash a whole column of values in one tight loop. Produces exactly the same digests as calling
+            hash_text on each value, without building a pandas row object for every value.
+
+        :param values: Column/Series (or any iterable) of values to be hashed.
+        :return: List of hexadecimal digests in the same order as values.
+        """
+        new = self.hashnew
+        digestcache = self.open_digest_cache()
+        if digestcache is None:
+            digests = [new(str(value).encode()).hexdigest() for value in values]
+            self.report.count('values_hashed', len(digests))
+            if self.cachepath is not None:
+                self.report.count('cache_bypassed', len(digests))
+            return digests
+
+        # Only hash the values that are not in the persistent digest cache yet, and add those to it.
+        plaintexts = [str(value) for value in values]
+        digests = digestcache.lookup(self.digestname, plaintexts)
+        computed = dict((p, new(p.encode()).hexdigest()) for p, digest in zip(plaintexts, digests) if digest is None)
+        misses = digests.count(None)
+        self.report.count('values_hashed', len(computed))
+        self.report.count('cache_hits', len(digests) - misses)
+        self.report.count('cache_misses', misses)
+        if computed:
+            digestcache.store(self.digestname, computed)
+            digests = [computed[p] if digest is None else digest for p, digest in zip(plaintexts, digests)]
+        return digests
+
+    @instrumented_stage
     def create_temp_db(self, files2process, fields2hash, inputdirectory):
         """ Processing logic for hashing the files and fields/columns selected by the
             user for processing. Input CSV files selected are iteratively looped through as well as the fields/columns
@@ -170,39 +1446,106 @@ class CSVCryptoHash(object):
         :param fields2hash: List containing the fields/columns selected for processing.
         :return: Temporary SQLite database used for subsequent processing.
         """
-        for self.file in files2process:
+        self.select_temp_store(files2process, fields2hash, inputdirectory)
+        if self.step_done('create_temp_db'):
+            return
+        self.start_file_progress(files2process, inputdirectory)
+        calls = []
+        for file in files2process:
+            for byterange in self.input_ranges(inputdirectory + file):
+                if self.step_done('create_temp_db', self.part_name(file, byterange)):
+                    self.progress.advance(self.input_bytes(inputdirectory + file, byterange))
+                else:
+                    calls.append((inputdirectory + file, fields2hash, byterange))
+        # Every distinct (FieldName, Plaintext) pair is hashed and stored once per run, whichever files it is found
+        # in. Worker processes cannot share the set, so the pairs they return are filtered before the insert.
+        distinct = {}
+        parallel = self.workers > 1 and len(calls) > 1
+        if not parallel:
+            calls = [call + (distinct,) for call in calls]
+            # The next file is read and hashed while the current one is inserted. The digest cache is opened here
+            # rather than by the first hash_many on the prefetch thread.
+            self.open_digest_cache()
+        depth = 0 if parallel else min(1, self.pipelinedepth)
+        with prefetch(self.map_files('hash_file_fields', calls), depth) as results:
+            for args, compositefiles in zip(calls, results):
+                if parallel:
+                    compositefiles = [self.drop_seen(compositefile, compositefile['FieldName'].iloc[0], distinct)
+                                      for compositefile in compositefiles if len(compositefile)]
+                self.insert_sqlite(compositefiles)
+                self.mark_done('create_temp_db', self.part_name(os.path.basename(args[0]), args[2]))
+                self.check_cancelled()
+        self.index_sqlite()
+        with self.SQLiteconnection.connect() as connection:
+            # Missing values (NULL plaintext) count as one distinct value, as in the 'mapfiles'
+            counts = connection.execute(sa.text('SELECT FieldName, COUNT(DISTINCT Plaintext) + MAX(Plaintext IS NULL) '
+                                                'FROM data GROUP BY FieldName'))
+            for field, count in counts:
+                self.report.add_field(field, distinct=count)
+        self.mark_done('create_temp_db')
+
+    @staticmethod
+    def part_name(file, byterange=None):
+        """ Name of an input file, or of a byte range of it (see input_ranges), in the checkpoint. """
+        return file if byterange is None else '%s@%d-%d' % (file, byterange[1], byterange[2])
+
+    def hash_file_fields(self, filepath, fields2hash, byterange=None, distinct=None):
+        """ Hash the distinct values of the selected fields/columns of one input file (see create_temp_db).
+
+        :param filepath: Path of the CSV input file.
+        :param fields2hash: List containing the fields/columns selected for processing.
+        :param byterange: None for the whole file, or the part of the file to process (see input_ranges).
+        :param distinct: Dictionary of field -> DistinctValues seen in earlier files, whose values are skipped (and
+                         to which the new values are added), or None to hash all distinct values of the file.
+        :return: List with one DataFrame (Hashvalue, Plaintext, FieldName) per field/column found in the file.
+        """
+        # Identify fields to read and processed in the selected file based on user selections and fields available.
+        self.fields2process = self.catalog.fields(filepath, fields2hash)
+
+        started = time.perf_counter()
+        self.pdcomposite = self.read_input(filepath, byterange, usecols=self.fields2process)
+
+        # Loop through selected fields and hash them
+        compositefiles = []
+        for self.field in self.fields2process:
+            self.check_cancelled()
+            fieldstarted = time.perf_counter()
+            # Create "composite_mapfile".
+            self.compositefile = self.pdcomposite.loc[:, [self.field]]
+            self.compositefile.drop_duplicates(inplace=True)
+            if distinct is not None:
+                self.compositefile = self.drop_seen(self.compositefile, self.field, distinct, self.field)
+            self.compositefile["Hashvalue"] = self.hash_many(self.compositefile[self.field])
+            self.compositefile["Plaintext"] = self.compositefile[self.field]
+            self.compositefile["FieldName"] = self.field
+            self.compositefile.drop([self.field], inplace=True, axis=1)
+            compositefiles.append(self.compositefile)
+            self.report.add_field(self.field, seconds=time.perf_counter() - fieldstarted)
+        self.report.add_file(os.path.basename(filepath), rows=len(self.pdcomposite),
+                             bytes=self.input_bytes(filepath, byterange), seconds=time.perf_counter() - started)
+        self.file_progress(filepath, byterange).done(len(self.pdcomposite))
+        self.pdcomposite = None
+        return compositefiles
 
-            # Read first line of selected file to get fieldnames available in this file
-            if not self.delim_whitespace:
-                self.fieldsavailable = pd.read_csv(inputdirectory + self.file, dtype=object, quotechar=self.quotechar,
-                                                   delimiter=self.inputdelimiter, nrows=1)
-            elif self.delim_whitespace:
-                self.fieldsavailable = pd.read_csv(inputdirectory + self.file, dtype=object, quotechar=self.quotechar,
-                                                   delim_whitespace=self.delim_whitespace,
-                                                   nrows=1)
-
-            # Identify fields to read and processed in the selected file based on user selections and fields available.
-            self.fields2process = list(set(fields2hash).intersection(list(self.fieldsavailable)))
-
-            if not self.delim_whitespace:
-                self.pdcomposite = pd.read_csv(inputdirectory + self.file, usecols=self.fields2process, dtype=object,
-                                               quotechar=self.quotechar, delimiter=self.inputdelimiter)
-            elif self.delim_whitespace:
-                self.pdcomposite = pd.read_csv(inputdirectory + self.file, usecols=self.fields2process, dtype=object,
-                                               quotechar=self.quotechar, delim_whitespace=self.delim_whitespace)
-
-            # Loop through selected fields, hash, and store them
-            for self.field in self.fields2process:
-                # Create "composite_mapfile".
-                self.compositefile = self.pdcomposite.loc[:, [self.field]]
-                self.compositefile.drop_duplicates(inplace=True)
-                self.compositefile["Hashvalue"] = self.compositefile.apply(lambda c: self.hash_text(c.loc[self.field]),
-                                                                           axis=1)
-                self.compositefile["Plaintext"] = self.compositefile[self.field]
-                self.compositefile["FieldName"] = self.field
-                self.compositefile.drop([self.field], inplace=True, axis=1)
-                self.compositefile.to_sql('data', self.SQLiteconnection, index=False, if_exists="append")
+    def drop_seen(self, frame, field, distinct, column='Plaintext'):
+        """ Drop the rows of a DataFrame of distinct values of one field/column that have been seen before.
 
+        :param frame: DataFrame holding the distinct values in column.
+        :param field: Field/column the values belong to.
+        :param distinct: Dictionary of field -> DistinctValues, updated with the new values.
+        :param column: Column of frame holding the values.
+        :return: DataFrame of the rows with new values.
+        """
+        new = distinct.setdefault(field, DistinctValues()).add_new(frame[column])
+        self.report.count('duplicates_skipped', int(len(new) - new.sum()))
+        return frame[new] if not new.all() else frame
+
+    @staticmethod
+    def input_bytes(filepath, byterange=None):
+        """ Number of bytes of an input file (or of the part of it in byterange) as stored on disk. """
+        return os.path.getsize(filepath) if byterange is None else byterange[2] - byterange[1]
+
+    @instrumented_stage
     def create_summary_hash_mapfile(self, fileextension, outputdirectory):
         """ Processing logic for hashing the file and fields/columns selected by the
             user for processing. This function creates a composite/summary 'mapfile' for all fields/columns
@@ -215,61 +1558,140 @@ class CSVCryptoHash(object):
                  File Name: Hash_MapFile_<hash format chosen>.<fileextension>
         """
 
-        # Read data from SQLite DB into pandas dataframe
+        outputpath = outputdirectory + self.summary_mapfile_name(fileextension)
+        if self.step_done('create_summary_hash_mapfile') and os.path.exists(outputpath):
+            return
+        self.start_mapfile_progress()
+        # Stream the sorted, de-duplicated map from the SQLite DB to the csv output file
         with self.SQLiteconnection.connect() as connection:
             results = connection.execution_options(stream_results=True).execute(
-                'SELECT * FROM data ORDER By FieldName, Plaintext')
-            df = pd.DataFrame(string_folding_wrapper(results))
-            df = df.rename(columns={0: 'Hashvalue', 1: 'Plaintext', 2: 'FieldName'})
+                sa.text('SELECT Hashvalue, Plaintext, FieldName FROM data ORDER By FieldName, Plaintext'))
+            written = self.write_sorted_rows(results, outputpath, ['Hashvalue', 'Plaintext', 'FieldName'],
+                                             ['Hashvalue'])
+        self.report.count('rows_written', written)
+        self.mark_done('create_summary_hash_mapfile')
 
-        # Remove any duplicates from CompositeMap
-        df.drop_duplicates(inplace=True)
+    def write_sorted_rows(self, rows, outputpath, columns, digestcolumns):
+        """ Write rows to an output file in batches of writebatchsize rows, so that memory use does not depend
+            on the number of rows. The rows must be sorted such that duplicate rows are adjacent; duplicates are
+            written only once.
 
-        # Write the de-duplicated CompositeMap to csv output file
-        df.to_csv(outputdirectory + 'Hash_MapFile_' + self.hstr + fileextension, index=False,
-                  encoding='utf-8', sep=self.outputdelimiter)
+        :param rows: Iterable of row tuples (or SQLAlchemy result rows).
+        :param outputpath: Path of the output file.
+        :param columns: Column names.
+        :param digestcolumns: Names of the columns holding hash values.
+        :return: Number of rows written.
+        """
+        writer = self.open_output(outputpath, digestcolumns)
+        written = 0
+        rows = iter(rows)
+        previous = None
+        first = True
+        exhausted = False
+        try:
+            while not exhausted:
+                self.check_cancelled()
+                batch = []
+                read = 0
+                for row in itertools.islice(rows, self.writebatchsize):
+                    read += 1
+                    row = tuple(row)
+                    if row != previous:
+                        batch.append(row)
+                        previous = row
+                # A batch may be empty because all of its rows were duplicates: only a short read ends the rows
+                exhausted = read < self.writebatchsize
+                if not batch and not first:
+                    continue
+                writer.write(pd.DataFrame(batch, columns=columns))
+                written += len(batch)
+                if self.progress.totalrows:
+                    # Stages writing 'mapfiles' from the SQLite DB count their progress in rows
+                    self.progress.advance(rows=len(batch))
+                first = False
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+        return written
 
+    def open_output(self, outputpath, digestcolumns, append=False, header=True):
+        """ Open an output file in the chosen outputformat.
+
+        :param outputpath: Path of the output file.
+        :param digestcolumns: Names of the columns holding hash values (stored as binary digests by Parquet/Arrow).
+        :param append: Whether to append to an existing output file instead of replacing it.
+        :param header: Whether to start a csv output file with the header line.
+        :return: CSVOutputWriter or ColumnarOutputWriter (written on a background thread, see BackgroundWriter, when
+                 pipelinedepth > 0), with write(DataFrame), close() and abort() methods. Callers abort the writer
+                 when the run fails before it is closed, which stops its thread and closes the output file.
+        """
+        if self.outputformat == 'csv':
+            writer = CSVOutputWriter(outputpath, self.outputdelimiter, append, header, self.outputcompression,
+                                     self.compressionthreads, self.compressionlevel)
+        else:
+            writer = ColumnarOutputWriter(outputpath, self.outputformat, digestcolumns, self.hashnew().digest_size,
+                                          self.columnarcompression, append)
+        if self.pipelinedepth > 0:
+            writer = BackgroundWriter(writer, self.pipelinedepth)
+        return writer
+
+    def output_extension(self, fileextension):
+        """ File extension of the output files. csv output files keep the extension of CSV input files, without
+            the compression extension of compressed input files and with that of outputcompression.
+
+        :param fileextension: File extension of input files, including any compression extension (.csv.gz).
+        :return: File extension of output files.
+        """
+        if self.outputformat != 'csv':
+            return OUTPUT_EXTENSIONS[self.outputformat]
+        if compression_of(fileextension):
+            fileextension = fileextension[:fileextension.rindex('.')]
+        if fileextension.lower() in PARQUET_EXTENSIONS:
+            fileextension = '.csv'
+        return fileextension + compression_extension(self.outputcompression)
+
+    def summary_mapfile_name(self, fileextension):
+        """ Name of the summary 'mapfile': Hash_MapFile_<hash format chosen>.<fileextension> """
+        return 'Hash_MapFile_' + self.hstr + self.output_extension(fileextension)
+
+    def field_mapfile_name(self, field, fileextension):
+        """ Name of a per field/column 'mapfile': <Field Name>_MapFile_<hash format chosen>.<fileextension> """
+        return field + '_MapFile_' + self.hstr + self.output_extension(fileextension)
+
+    @instrumented_stage
     def create_column_hash_mapfile(self, files2process, fields2hash, fileextension, inputdirectory, outputdirectory):
         """ Processing logic for hashing the file(s) and field(s) selected by the user for processing.
             This function creates a separate 'mapfile' for each field selected for hashing within all
             input files chosen for processing.
 
         :param outputdirectory: Location for output files
-        :param inputdirectory: Location of CSV input file(s)
+        :param inputdirectory: Location of CSV input file(s). Not used; the fields come from the SQLite DB.
         :param fields2hash: Field(s) selected to be hashed.
-        :param files2process: Current input file(s) being processed.
+        :param files2process: Current input file(s) being processed. Not used; the fields come from the SQLite DB.
         :param fileextension: File extension of input file.
         :return: Separate CSV 'mapfile' for each hashed field/column written to same folder as input files with the
                  following characteristics:
                  Column Names: <Field Name>,<Field Name_Plaintext>.
                  File Name: <Field Name>_MapFile_<hash format chosen>.<fileextension>
         """
-        for self.file in files2process:
-
-            # Read first line of selected file to get fieldnames available in this file
-            if not self.delim_whitespace:
-                self.fieldsavailable = pd.read_csv(inputdirectory + self.file, dtype=object, quotechar=self.quotechar,
-                                                   delimiter=self.inputdelimiter, nrows=1)
-            elif self.delim_whitespace:
-                self.fieldsavailable = pd.read_csv(inputdirectory + self.file, dtype=object, quotechar=self.quotechar,
-                                                   delim_whitespace=self.delim_whitespace, nrows=1)
-
-            # Identify fields to read and process in the selected file based on user selections and fields available.
-            self.fields2process = list(set(fields2hash).intersection(list(self.fieldsavailable)))
-
-            for field in self.fields2process:
-                with self.SQLiteconnection.connect() as connection:
-                    stmt = sa.text("SELECT * FROM data where FieldName == :fieldname ORDER BY Hashvalue")
-                    results = connection.execution_options(stream_results=True).execute(stmt, fieldname=field)
-                    df = pd.DataFrame(string_folding_wrapper(results))
-                    df = df.rename(columns={0: 'Hashvalue', 1: 'Plaintext', 2: 'FieldName'})
-                    df.drop('FieldName', axis=1, inplace=True)
-                    newname = field + '_Plaintext'
-                    df.columns = [field, newname]
-                    df.drop_duplicates(inplace=True)
-                    df.to_csv(outputdirectory + field + '_MapFile_' + self.hstr + fileextension, index=False,
-                              encoding='utf-8', sep=self.outputdelimiter)
+        self.start_mapfile_progress()
+        # The data table only holds fields found in the input files. One scan ordered by FieldName, Hashvalue
+        # (covered by the data_fieldname_hashvalue index) writes every field's 'mapfile' exactly once.
+        with self.SQLiteconnection.connect() as connection:
+            results = connection.execution_options(stream_results=True).execute(
+                sa.text('SELECT Hashvalue, Plaintext, FieldName FROM data ORDER BY FieldName, Hashvalue, Plaintext'))
+            for field, rows in itertools.groupby(results, key=lambda row: row[2]):
+                outputpath = outputdirectory + self.field_mapfile_name(field, fileextension)
+                if field in fields2hash and not (self.step_done('create_column_hash_mapfile', field) and
+                                                 os.path.exists(outputpath)):
+                    written = self.write_sorted_rows(((row[0], row[1]) for row in rows), outputpath,
+                                                     [field, field + '_Plaintext'], [field])
+                    self.report.add_field(field, distinct=written)
+                    self.report.count('rows_written', written)
+                    self.mark_done('create_column_hash_mapfile', field)
 
+    @instrumented_stage
     def create_hashed_version_of_input(self, files2process, fields2hash, fileextension, inputdirectory,
                                        outputdirectory):
         """ Processing logic for hashing the file(s) and field(s) selected by the user for processing.
@@ -286,28 +1708,531 @@ class CSVCryptoHash(object):
                  File Name: Hashed_<Original input CSV file name>_<hash format chosen>.<fileextension>
         """
 
-        self.mapfile = pd.read_sql_query("SELECT Plaintext, Hashvalue FROM data;", self.SQLiteconnection)
-        self.mapping = self.mapfile[['Plaintext', 'Hashvalue']].set_index('Plaintext')['Hashvalue'].to_dict()
+        self.start_file_progress(files2process, inputdirectory)
+        completed = [file for file in files2process if self.step_done('create_hashed_version_of_input', file) and
+                     os.path.exists(outputdirectory + self.hashed_file_name(file, fileextension))]
+        self.progress.advance(sum(self.input_bytes(inputdirectory + file) for file in completed))
+        files2process = [file for file in files2process if file not in completed]
+        if self.workers > 1:
+            # Every mapped value is the hash of its plaintext, so the worker processes hash the selected
+            # fields/columns directly instead of each loading the mapping.
+            calls, parts = self.hash_and_write_calls(files2process, fields2hash, fileextension, inputdirectory,
+                                                     outputdirectory, None)
+            if len(calls) > 1:
+                for _ in self.map_files('hash_and_write_file', calls):
+                    self.check_cancelled()
+                self.join_parts(parts)
+                for file in files2process:
+                    self.mark_done('create_hashed_version_of_input', file)
+                return
 
-        for self.file in files2process:
-            # Read first line of selected file to get fieldnames available in this file
-            if not self.delim_whitespace:
-                self.fieldsavailable = pd.read_csv(inputdirectory + self.file, dtype=object, quotechar=self.quotechar,
-                                                   delimiter=self.inputdelimiter, nrows=1)
-            elif self.delim_whitespace:
-                self.fieldsavailable = pd.read_csv(inputdirectory + self.file, dtype=object, quotechar=self.quotechar,
-                                                   delim_whitespace=self.delim_whitespace, nrows=1)
+        # Compact per field/column mappings, each loaded from the SQLite DB the first time the field is needed.
+        self.mapping = {}
 
+        for self.file in files2process:
             # Identify fields to read and process in the selected file based on user selections and fields available.
-            self.fields2process = list(set(fields2hash).intersection(list(self.fieldsavailable)))
-
-            if not self.delim_whitespace:
-                self.inputfile = pd.read_csv(inputdirectory + self.file, dtype=object, quotechar=self.quotechar,
-                                             delimiter=self.inputdelimiter)
-            elif self.delim_whitespace:
-                self.inputfile = pd.read_csv(inputdirectory + self.file, dtype=object, quotechar=self.quotechar,
-                                             delim_whitespace=self.delim_whitespace)
-            self.inputfile[self.fields2process] = self.inputfile[self.fields2process].applymap(self.mapping.get)
-            self.newname = 'Hashed_' + self.file.replace(fileextension, '_' + self.hstr + fileextension)
-            self.inputfile.to_csv(outputdirectory + self.newname, index=False, encoding='utf-8',
-                                  sep=self.outputdelimiter)
+            self.fields2process = self.catalog.fields(inputdirectory + self.file, fields2hash)
+
+            self.newname = self.hashed_file_name(self.file, fileextension)
+
+            # In streaming mode, read, map and append the output one chunk at a time so that memory use is bounded
+            # by the chunk size (and the mapping) rather than by the size of the input file.
+            if self.chunksize is None and self.chunkbytes is None:
+                chunks = [self.read_csv(inputdirectory + self.file)]
+            else:
+                chunks = self.read_csv(inputdirectory + self.file,
+                                       chunksize=self.rows_per_chunk(inputdirectory + self.file))
+            started = time.perf_counter()
+            rows = 0
+            fileprogress = self.file_progress(inputdirectory + self.file)
+            writer = self.open_output(outputdirectory + self.newname, self.fields2process)
+            try:
+                with prefetch(chunks, self.pipelinedepth) as inputfiles:
+                    for self.inputfile in inputfiles:
+                        self.check_cancelled()
+                        for field in self.fields2process:
+                            fieldstarted = time.perf_counter()
+                            if field not in self.mapping:
+                                self.mapping[field] = self.load_digest_map(field)
+                            self.inputfile[field] = self.mapping[field].lookup(self.inputfile[field])
+                            self.report.add_field(field, seconds=time.perf_counter() - fieldstarted)
+                        writer.write(self.inputfile)
+                        rows += len(self.inputfile)
+                        fileprogress.advance(len(self.inputfile))
+            except BaseException:
+                writer.abort()
+                raise
+            writer.close()
+            fileprogress.done()
+            self.inputfile = None
+            self.report.add_file(self.file, rows=rows, bytes=self.input_bytes(inputdirectory + self.file),
+                                 seconds=time.perf_counter() - started)
+            self.mark_done('create_hashed_version_of_input', self.file)
+        self.mapping = None
+
+    def load_digest_map(self, field):
+        """ Load the distinct values of one field/column and their hash values from the SQLite DB.
+
+        :param field: Field/column name.
+        :return: DigestMap for the field.
+        """
+        digestmap = DigestMap(self.hashnew().digest_size)
+        with self.SQLiteconnection.connect() as connection:
+            results = connection.execution_options(stream_results=True).execute(
+                sa.text('SELECT Plaintext, Hashvalue FROM data WHERE FieldName = :fieldname '
+                        'AND Plaintext IS NOT NULL'), fieldname=field)
+            while True:
+                rows = results.fetchmany(self.writebatchsize)
+                if not rows:
+                    break
+                digestmap.add([row[0] for row in rows], [row[1] for row in rows])
+        digestmap.finish()
+        return digestmap
+
+    @instrumented_stage
+    def create_outputs_single_pass(self, files2process, fields2hash, fileextension, inputdirectory, outputdirectory):
+        """ Alternative to the create_temp_db / create_summary_hash_mapfile / create_column_hash_mapfile /
+            create_hashed_version_of_input pipeline that reads each input file only once and does not use the
+            temporary SQLite database. The selected fields/columns are hashed and the hashed version of each input
+            file is written while the distinct (FieldName, Plaintext, Hashvalue) entries are collected in memory.
+            The summary and per field/column 'mapfiles' are then written from the collected entries. All output
+            files are identical to the ones written by the SQLite pipeline.
+
+        :param outputdirectory: Location for output files
+        :param inputdirectory: Location of CSV input file(s)
+        :param fileextension: File extension of input files.
+        :param files2process: Input file(s) to be processed.
+        :param fields2hash: Field(s) selected to be hashed.
+        :return: Hashed version of every input file, the summary 'mapfile' and one 'mapfile' per field/column.
+        """
+        # Distinct plaintext -> hash value per field. Missing values (NaN) are hashed as 'nan' and kept under the
+        # key None, exactly like the SQLite pipeline stores them as NULL plaintext.
+        self.fieldmaps = {}
+        self.start_file_progress(files2process, inputdirectory)
+
+        # Worker processes each return the entries of their own file (part), which are merged here in input order.
+        calls, parts = self.hash_and_write_calls(files2process, fields2hash, fileextension, inputdirectory,
+                                                 outputdirectory, self.fieldmaps)
+        parallel = self.workers > 1 and len(calls) > 1
+        for fieldmaps in self.map_files('hash_and_write_file', calls):
+            self.check_cancelled()
+            if parallel:
+                for field, fieldmap in fieldmaps.items():
+                    self.fieldmaps.setdefault(field, {}).update(fieldmap)
+        self.join_parts(parts)
+
+        self.write_mapfiles(self.fieldmaps, fileextension, outputdirectory)
+        self.fieldmaps = None
+
+    @instrumented_stage
+    def create_outputs_incremental(self, files2process, fields2hash, fileextension, inputdirectory,
+                                   outputdirectory):
+        """ Incremental version of create_outputs_single_pass for append-only input files. A manifest
+            (Hash_Manifest_<hash format chosen>.json in the output directory) records, per input file, how many bytes
+            have already been processed and a fingerprint of those bytes. Only rows appended since the last run, and
+            files that are new (or no longer match their fingerprint), are hashed. Their hashed rows are appended to
+            the existing Hashed_ files and their distinct values are merged into the existing 'mapfiles' in one
+            streaming pass. A last row that is not terminated by a line break is left for the next run, with a warning
+            and its size in the run report (skipped_tail_bytes), since it may still be being appended to; it is hashed
+            once the size of the file is unchanged since the previous run.
+
+        :param outputdirectory: Location for output files
+        :param inputdirectory: Location of CSV input file(s)
+        :param fileextension: File extension of input files.
+        :param files2process: Input file(s) to be processed.
+        :param fields2hash: Field(s) selected to be hashed.
+        :return: Same output files as create_outputs_single_pass.
+        """
+        if self.outputformat != 'csv' or fileextension.lower() in PARQUET_EXTENSIONS or compression_of(fileextension):
+            raise ValueError('Incremental mode requires uncompressed CSV input files and CSV output files')
+        manifestpath = outputdirectory + 'Hash_Manifest_' + self.hstr + '.json'
+        # Appended rows must be read like the rows before them: the dialect is part of the settings
+        settings = {'fields2hash': sorted(fields2hash), 'hstr': self.hstr, 'outputdelimiter': self.outputdelimiter,
+                    'fileextension': fileextension, 'inputdelimiter': self.inputdelimiter,
+                    'quotechar': self.quotechar, 'delim_whitespace': self.delim_whitespace}
+        if self.keyid is not None:
+            # Rows hashed with another key must not be appended to
+            settings['keyid'] = self.keyid
+        manifest = {'settings': settings, 'files': {}}
+        if os.path.exists(manifestpath):
+            with open(manifestpath) as handle:
+                previous = json.load(handle)
+            if previous.get('settings') == settings:
+                manifest = previous
+
+        # Only the distinct values of the new rows are collected; they are merged into the existing 'mapfiles'.
+        self.fieldmaps = {}
+        merge = bool(manifest['files']) and os.path.exists(outputdirectory + self.summary_mapfile_name(fileextension))
+
+        parallel = self.workers > 1
+        calls = []
+        updates = {}
+        for file in files2process:
+            filepath = inputdirectory + file
+            outputpath = outputdirectory + self.hashed_file_name(file, fileextension)
+            headerend = record_boundaries(filepath, [0], self.quotechar)[0]
+            entry = manifest['files'].get(file)
+            append = (entry is not None and os.path.exists(outputpath) and
+                      os.path.getsize(filepath) >= entry['offset'] and
+                      file_fingerprint(filepath, entry['offset']) == entry['fingerprint'])
+            start = entry['offset'] if append else headerend
+            size = os.path.getsize(filepath)
+            end = last_record_end(filepath, start, self.quotechar)
+            if end < size and append and entry.get('size') == size:
+                # The file has not grown since the previous run, so its unterminated last row is complete
+                end = size
+            if end < size:
+                self.report.add_file(file, skipped_tail_bytes=size - end)
+                self.report.count('skipped_tail_bytes', size - end)
+                warnings.warn('%s: the last %d bytes are not terminated by a line break and are left for the next run'
+                              % (file, size - end))
+            if append and end == start:
+                updates[file] = dict(entry, size=size)
+                continue
+            calls.append((filepath, outputpath, fields2hash, {} if parallel else self.fieldmaps,
+                          (headerend, start, end), not append, append))
+            updates[file] = {'offset': end, 'fingerprint': file_fingerprint(filepath, end), 'size': size}
+
+        self.progress.start(totalbytes=sum(call[4][2] - call[4][1] for call in calls))
+        for fieldmaps in self.map_files('hash_and_write_file', calls):
+            self.check_cancelled()
+            if parallel:
+                for field, fieldmap in fieldmaps.items():
+                    self.fieldmaps.setdefault(field, {}).update(fieldmap)
+
+        self.write_mapfiles(self.fieldmaps, fileextension, outputdirectory, merge)
+        self.fieldmaps = None
+
+        manifest['files'].update(updates)
+        with open(manifestpath + '.tmp', 'w') as handle:
+            json.dump(manifest, handle, indent=1, sort_keys=True)
+        os.replace(manifestpath + '.tmp', manifestpath)
+
+    def write_mapfiles(self, fieldmaps, fileextension, outputdirectory, merge=False):
+        """ Write the summary 'mapfile' and the per field/column 'mapfiles' from collected entries.
+
+        :param fieldmaps: Dictionary of field -> {plaintext: hash value}. Missing values (NaN) are kept under the
+                          key None, like the NULL plaintext of the SQLite pipeline.
+        :param fileextension: File extension of input files.
+        :param outputdirectory: Location for output files
+        :param merge: Whether to merge the entries into the existing 'mapfiles' (see write_merged_rows) rather than
+                      replace them.
+        :return: Same 'mapfiles' as create_summary_hash_mapfile and create_column_hash_mapfile.
+        """
+        # Summary 'mapfile': Hashvalue, Plaintext, FieldName ordered by FieldName, Plaintext
+        rows = ((h, p, field) for field in sorted(fieldmaps)
+                for p, h in sorted(fieldmaps[field].items(), key=lambda entry: plaintext_key(entry[0])))
+        self.write_merged_rows(rows, outputdirectory + self.summary_mapfile_name(fileextension),
+                               ['Hashvalue', 'Plaintext', 'FieldName'], ['Hashvalue'],
+                               lambda row: (row[2], plaintext_key(row[1])), merge)
+
+        # Per field/column 'mapfiles': <Field Name>, <Field Name>_Plaintext ordered by hash value
+        def order(row):
+            return row[0], plaintext_key(row[1])
+
+        for field in fieldmaps:
+            written = self.write_merged_rows(sorted(((h, p) for p, h in fieldmaps[field].items()), key=order),
+                                             outputdirectory + self.field_mapfile_name(field, fileextension),
+                                             [field, field + '_Plaintext'], [field], order, merge)
+            self.report.add_field(field, distinct=written)
+
+    def write_merged_rows(self, rows, outputpath, columns, digestcolumns, key, merge=True):
+        """ Write sorted rows merged with the rows of an existing output file sorted in the same order (see
+            write_sorted_rows), in one streaming pass. Rows found in both are written once. The existing file is
+            replaced once the merged file is complete.
+
+        :param rows: Iterable of row tuples, sorted by key.
+        :param outputpath: Path of the output file.
+        :param columns: Column names.
+        :param digestcolumns: Names of the columns holding hash values.
+        :param key: Sort key of a row tuple.
+        :param merge: Whether to merge the rows with the existing output file, if any, rather than replace it.
+        :return: Number of rows written.
+        """
+        if not merge or not os.path.exists(outputpath):
+            return self.write_sorted_rows(rows, outputpath, columns, digestcolumns)
+        rows = heapq.merge(self.read_map_rows(outputpath), rows, key=key)
+        written = self.write_sorted_rows(rows, outputpath + '.tmp', columns, digestcolumns)
+        os.replace(outputpath + '.tmp', outputpath)
+        return written
+
+    @instrumented_stage
+    def create_shard_mapfiles(self, files2process, fields2hash, inputdirectory, sharddirectory, shard, nshards):
+        """ Sharded alternative to the 'mapfiles' stages for runs spread over several processes or nodes that share
+            a filesystem. The distinct (FieldName, Plaintext) pairs are partitioned into nshards shards (see
+            shard_of); this process reads every input file, but only hashes and keeps the pairs of its own shard.
+            They are written, sorted, to two shard map files in sharddirectory, which merge_shard_mapfiles merges
+            into the usual 'mapfiles' once every shard is complete:
+            Hash_MapShard_<hash format>_<shard>of<nshards>.csv (ordered by FieldName, Plaintext) and
+            Hash_MapShardByHash_<hash format>_<shard>of<nshards>.csv (ordered by FieldName, Hashvalue, Plaintext),
+            described by Hash_MapShard_<hash format>_<shard>of<nshards>.json, which is written last.
+
+        :param files2process: Input file(s) to be processed.
+        :param fields2hash: Field(s) selected to be hashed.
+        :param inputdirectory: Location of CSV input file(s)
+        :param sharddirectory: Location of the shard map files, shared by all shards.
+        :param shard: Shard processed by this call, from 0 to nshards - 1.
+        :param nshards: Number of shards.
+        :return: No explicit value returned.
+        """
+        if not 0 <= shard < nshards:
+            raise ValueError('Shard %d does not exist; there are %d shards' % (shard, nshards))
+        self.fieldmaps = {}
+        self.start_file_progress(files2process, inputdirectory)
+        parallel = self.workers > 1
+        calls = [(inputdirectory + file, fields2hash, shard, nshards, {} if parallel else self.fieldmaps, byterange)
+                 for file in files2process for byterange in self.input_ranges(inputdirectory + file)]
+        for fieldmaps in self.map_files('hash_shard_values', calls):
+            self.check_cancelled()
+            if parallel:
+                for field, fieldmap in fieldmaps.items():
+                    self.fieldmaps.setdefault(field, {}).update(fieldmap)
+
+        name = sharddirectory + 'Hash_MapShard%s_' + self.shard_name(shard, nshards)
+        columns = ['Hashvalue', 'Plaintext', 'FieldName']
+        orders = {'': lambda row: (row[2], plaintext_key(row[1])),
+                  'ByHash': lambda row: (row[2], row[0], plaintext_key(row[1]))}
+        for variant, order in orders.items():
+            rows = sorted(((h, p, field) for field, fieldmap in self.fieldmaps.items() for p, h in fieldmap.items()),
+                          key=order)
+            writer = CSVOutputWriter(name % variant + '.csv.tmp', self.outputdelimiter)
+            try:
+                for start in range(0, max(1, len(rows)), self.writebatchsize):
+                    writer.write(pd.DataFrame(rows[start:start + self.writebatchsize], columns=columns))
+            except BaseException:
+                writer.abort()
+                raise
+            writer.close()
+            os.replace(name % variant + '.csv.tmp', name % variant + '.csv')
+        # The description is written last: a shard is complete once it exists
+        with open(name % '' + '.json.tmp', 'w') as handle:
+            json.dump({'hstr': self.hstr, 'keyid': self.keyid, 'fields2hash': sorted(fields2hash),
+                       'files': sorted(files2process), 'outputdelimiter': self.outputdelimiter, 'shard': shard,
+                       'nshards': nshards, 'entries': sum(len(fieldmap) for fieldmap in self.fieldmaps.values())},
+                      handle, indent=1, sort_keys=True)
+        os.replace(name % '' + '.json.tmp', name % '' + '.json')
+        for field, fieldmap in self.fieldmaps.items():
+            self.report.add_field(field, distinct=len(fieldmap))
+        self.fieldmaps = None
+
+    def hash_shard_values(self, filepath, fields2hash, shard, nshards, fieldmaps, byterange=None):
+        """ Hash the distinct values of the selected fields/columns of one input file that belong to a shard (see
+            create_shard_mapfiles).
+
+        :param filepath: Path of the CSV input file.
+        :param fields2hash: Field(s) selected to be hashed.
+        :param shard: Shard to keep the values of.
+        :param nshards: Number of shards.
+        :param fieldmaps: Dictionary of field -> {plaintext: hash value} that is updated with the values of the
+                          shard found in the file. Missing values (NaN) are kept under the key None.
+        :param byterange: None for the whole file, or the part of the file to process (see input_ranges).
+        :return: fieldmaps
+        """
+        started = time.perf_counter()
+        rows = 0
+        fileprogress = self.file_progress(filepath, byterange)
+        fields = self.catalog.fields(filepath, fields2hash)
+        if self.chunksize is None and self.chunkbytes is None:
+            chunks = [self.read_input(filepath, byterange, usecols=fields)]
+        else:
+            chunks = self.read_input(filepath, byterange, usecols=fields, chunksize=self.rows_per_chunk(filepath))
+        with prefetch(chunks, self.pipelinedepth) as chunks:
+            for chunk in chunks:
+                self.check_cancelled()
+                for field in fields:
+                    fieldstarted = time.perf_counter()
+                    fieldmap = fieldmaps.setdefault(field, {})
+                    newvalues = []
+                    for value in pd.unique(chunk[field]):
+                        plaintext = value if isinstance(value, str) else None
+                        if plaintext not in fieldmap and shard_of(field, plaintext, nshards) == shard:
+                            newvalues.append(plaintext)
+                            # Placeholder until the batch is hashed, so that a value is only collected once
+                            fieldmap[plaintext] = None
+                    hashvalues = self.hash_many([float('nan') if p is None else p for p in newvalues])
+                    fieldmap.update(zip(newvalues, hashvalues))
+                    self.report.add_field(field, seconds=time.perf_counter() - fieldstarted)
+                rows += len(chunk)
+                fileprogress.advance(len(chunk))
+        fileprogress.done()
+        self.report.add_file(os.path.basename(filepath), rows=rows, bytes=self.input_bytes(filepath, byterange),
+                             seconds=time.perf_counter() - started)
+        return fieldmaps
+
+    def shard_name(self, shard, nshards):
+        """ Name of the files of a shard, without their Hash_MapShard_ / Hash_MapShardByHash_ prefix and extension. """
+        return '%s_%dof%d' % (self.hstr, shard, nshards)
+
+    @instrumented_stage
+    def merge_shard_mapfiles(self, fields2hash, fileextension, sharddirectory, outputdirectory, nshards):
+        """ Merge the shard map files of every shard (see create_shard_mapfiles) into the summary and per
+            field/column 'mapfiles', identical to the ones of a single-node run. The shards are disjoint and sorted,
+            so they are merged in one streaming pass whatever their size.
+
+        :param fields2hash: Field(s) selected to be hashed.
+        :param fileextension: File extension of input files.
+        :param sharddirectory: Location of the shard map files.
+        :param outputdirectory: Location for output files
+        :param nshards: Number of shards.
+        :return: No explicit value returned.
+        """
+        names = [sharddirectory + 'Hash_MapShard%s_' + self.shard_name(shard, nshards) for shard in range(nshards)]
+        missing = [str(shard) for shard in range(nshards) if not os.path.exists(names[shard] % '' + '.json')]
+        if missing:
+            raise ValueError('Shard(s) %s of %d are not complete yet' % (', '.join(missing), nshards))
+        entries = 0
+        files = None
+        for shard, name in enumerate(names):
+            with open(name % '' + '.json') as handle:
+                description = json.load(handle)
+            if (description['keyid'], description['fields2hash']) != (self.keyid, sorted(fields2hash)):
+                raise ValueError('Shard %d was created with another key or other fields' % shard)
+            # The shard map files are read with the outputdelimiter of this run (see read_map_rows)
+            if description.get('outputdelimiter') != self.outputdelimiter:
+                raise ValueError('Shard %d was created with another output delimiter' % shard)
+            # Every shard must have read the same input files, or the merged 'mapfiles' would miss or mix values
+            if files is None:
+                files = sorted(description['files'])
+            elif sorted(description['files']) != files:
+                raise ValueError('Shard %d was created from other input files than shard 0' % shard)
+            entries += description['entries']
+
+        # Every entry is written twice: to the summary 'mapfile' and to its field's 'mapfile'
+        self.progress.start(totalrows=2 * entries)
+        summary = heapq.merge(*[self.read_map_rows(name % '' + '.csv') for name in names],
+                              key=lambda row: (row[2], plaintext_key(row[1])))
+        written = self.write_sorted_rows(summary, outputdirectory + self.summary_mapfile_name(fileextension),
+                                         ['Hashvalue', 'Plaintext', 'FieldName'], ['Hashvalue'])
+        self.report.count('rows_written', written)
+        byhash = heapq.merge(*[self.read_map_rows(name % 'ByHash' + '.csv') for name in names],
+                             key=lambda row: (row[2], row[0], plaintext_key(row[1])))
+        for field, rows in itertools.groupby(byhash, key=lambda row: row[2]):
+            written = self.write_sorted_rows(((row[0], row[1]) for row in rows),
+                                             outputdirectory + self.field_mapfile_name(field, fileextension),
+                                             [field, field + '_Plaintext'], [field])
+            self.report.add_field(field, distinct=written)
+            self.report.count('rows_written', written)
+
+    def read_map_rows(self, mappath):
+        """ Stream the rows of a csv 'mapfile' or shard map file, with None for missing values (plaintext).
+
+        :param mappath: Path of the map file.
+        :return: Iterator over row tuples.
+        """
+        for chunk in pd.read_csv(mappath, dtype=object, sep=self.outputdelimiter, keep_default_na=False,
+                                 na_values=[''], chunksize=self.writebatchsize):
+            for row in chunk.itertuples(index=False, name=None):
+                yield tuple(value if isinstance(value, str) else None for value in row)
+
+    def hashed_file_name(self, file, fileextension):
+        """ Name of the hashed version of an input file: Hashed_<input file name>_<hash format>.<fileextension>
+
+        :param file: Input file name.
+        :param fileextension: File extension of input files.
+        :return: Output file name.
+        """
+        return 'Hashed_' + file.replace(fileextension, '_' + self.hstr + self.output_extension(fileextension))
+
+    def hash_and_write_calls(self, files2process, fields2hash, fileextension, inputdirectory, outputdirectory,
+                             fieldmaps):
+        """ Arguments of the hash_and_write_file calls needed to write the hashed version of the input files. Files
+            split into byte ranges (see input_ranges) get one call, and one partial output file, per range.
+
+        :param fieldmaps: Dictionary to collect the distinct values in, or None if they are not needed. Each call
+                          gets its own dictionary when the calls are run in worker processes.
+        :return: (list of calls, list of (output file, list of partial output files))
+        """
+        parallel = self.workers > 1
+        calls = []
+        parts = []
+        for file in files2process:
+            outputpath = outputdirectory + self.hashed_file_name(file, fileextension)
+            ranges = self.input_ranges(inputdirectory + file)
+            if len(ranges) == 1:
+                partpaths = [outputpath]
+            else:
+                partpaths = [outputpath + '.part%d' % k for k in range(len(ranges))]
+                parts.append((outputpath, partpaths))
+            for k, (partpath, byterange) in enumerate(zip(partpaths, ranges)):
+                callmaps = {} if parallel and fieldmaps is not None else fieldmaps
+                calls.append((inputdirectory + file, partpath, fields2hash, callmaps, byterange, k == 0))
+        return calls, parts
+
+    def join_parts(self, parts):
+        """ Concatenate partial output files, in order, into their output file and remove them.
+
+        :param parts: List of (output file, list of partial output files).
+        :return: No explicit value returned.
+        """
+        for outputpath, partpaths in parts:
+            if self.outputformat != 'csv':
+                join_columnar_parts(outputpath, partpaths, self.outputformat, self.columnarcompression)
+                continue
+            with open(outputpath, 'wb') as output:
+                for partpath in partpaths:
+                    with open(partpath, 'rb') as part:
+                        shutil.copyfileobj(part, output, 1 << 20)
+                    os.remove(partpath)
+
+    def hash_and_write_file(self, filepath, outputpath, fields2hash, fieldmaps=None, byterange=None,
+                            writeheader=True, append=False):
+        """ Read one input file once, hash its selected fields/columns directly and write its hashed version (see
+            create_outputs_single_pass).
+
+        :param filepath: Path of the CSV input file.
+        :param outputpath: Path of the hashed output file.
+        :param fields2hash: Field(s) selected to be hashed.
+        :param fieldmaps: Dictionary of field -> {plaintext: hash value} that is updated with the distinct values
+                          found in the file, or None if the values are not needed.
+        :param byterange: None for the whole file, or the part of the file to process (see input_ranges).
+        :param writeheader: Whether to start the output with the header line.
+        :param append: Whether to append to an existing output file instead of replacing it.
+        :return: fieldmaps
+        """
+        started = time.perf_counter()
+        rows = 0
+        fileprogress = self.file_progress(filepath, byterange)
+        filemaps = {} if fieldmaps is None else fieldmaps
+        if self.chunksize is None and self.chunkbytes is None:
+            chunks = [self.read_input(filepath, byterange)]
+        else:
+            chunks = self.read_input(filepath, byterange, chunksize=self.rows_per_chunk(filepath))
+
+        writer = None
+        try:
+            with prefetch(chunks, self.pipelinedepth) as inputfiles:
+                for self.inputfile in inputfiles:
+                    self.check_cancelled()
+                    if writer is None:
+                        self.fields2process = self.catalog.fields(filepath, fields2hash)
+                        writer = self.open_output(outputpath, self.fields2process, append, writeheader)
+                    for field in self.fields2process:
+                        fieldstarted = time.perf_counter()
+                        fieldmap = filemaps.setdefault(field, {})
+                        column = self.inputfile[field]
+                        if None not in fieldmap and column.isnull().any():
+                            fieldmap[None] = self.hash_many([float('nan')])[0]
+                        newvalues = [v for v in column.dropna().unique() if v not in fieldmap]
+                        fieldmap.update(zip(newvalues, self.hash_many(newvalues)))
+                        self.inputfile[field] = [fieldmap[v] if isinstance(v, str) else None for v in column]
+                        self.report.add_field(field, seconds=time.perf_counter() - fieldstarted)
+                    writer.write(self.inputfile)
+                    rows += len(self.inputfile)
+                    fileprogress.advance(len(self.inputfile))
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        writer.close()
+        fileprogress.done()
+        self.inputfile = None
+        self.report.add_file(os.path.basename(filepath), rows=rows, bytes=self.input_bytes(filepath, byterange),
+                             seconds=time.perf_counter() - started)
+        return fieldmaps
+
+
+if __name__ == '__main__':
+    # Headless command line entry point, see itellihashcli.py
+    from itellihashcli import main
+
+    sys.exit(main())
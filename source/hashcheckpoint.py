@@ -0,0 +1,148 @@
+# coding: utf-8
+# hashcheckpoint.py
+# Copyright 2018 iTtelligent, LLC., Kirby J. Davis (kdavis@itelligentllc.com)
+
+"""This file is part of iTelliHashCSV.
+
+    iTelliHashCSV - A Cryptographic Hashing Application for CSV Files
+    Copyright (C) 2018 iTelligent, LLC (Kirby J. Davis)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+    """
+
+
+import json
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+class RunCheckpoint(object):
+    """
+    Durable record of the work completed by a run: whole stages, and the files (or fields) completed within a
+    stage. It is rewritten atomically after every step, so that a run that was cancelled or crashed can be
+    restarted and resume after the last completed step. A checkpoint only applies to a run with the same
+    identity (settings, input files and their sizes and modification times...); any other run starts afresh.
+    """
+
+    def __init__(self, path, identity):
+        self.path = path
+        self.identity = identity
+        self.stages = {}
+        self.resumed = False
+        if os.path.exists(path):
+            try:
+                with open(path) as handle:
+                    saved = json.load(handle)
+            except ValueError:
+                saved = {}
+            if saved.get('identity') == identity:
+                self.stages = saved['stages']
+                self.resumed = True
+
+    def done(self, stage, item=None):
+        """ Whether a stage (or an item, e.g. a file, of the stage) has been completed. """
+        if item is None:
+            return self.stages.get(stage) is True
+        return self.stages.get(stage) is True or item in (self.stages.get(stage) or [])
+
+    def mark(self, stage, item=None):
+        """ Record that a stage (or an item of the stage) has been completed. """
+        if item is None:
+            self.stages[stage] = True
+        elif self.stages.get(stage) is not True:
+            self.stages.setdefault(stage, []).append(item)
+        self.save()
+
+    def save(self):
+        temppath = self.path + '.tmp'
+        with open(temppath, 'w') as handle:
+            json.dump({'identity': self.identity, 'stages': self.stages}, handle, indent=1, sort_keys=True)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temppath, self.path)
+
+    def remove(self):
+        """ Remove the checkpoint once the run is complete. """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class RunLock(object):
+    """
+    Exclusive lock of the database and checkpoint of a run, so that two runs with the same identity (e.g. the
+    same input files hashed into two output directories at the same time) never share them. The lock is held on
+    an open lock file, so the operating system releases it when the process ends: a run that crashed leaves no
+    stale lock behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def acquire(self):
+        """ Take the lock without waiting.
+
+        :return: Whether the lock was taken; False when another run holds it.
+        """
+        while self.handle is None:
+            handle = open(self.path, 'a+b')
+            try:
+                if fcntl is not None:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    handle.seek(0)
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            except OSError:
+                handle.close()
+                return False
+            try:
+                current = os.stat(self.path)
+            except OSError:
+                current = None
+            if current is not None and os.path.samestat(current, os.fstat(handle.fileno())):
+                self.handle = handle
+            else:
+                # The lock file was removed by the run that held it while this one was waiting for it: lock the
+                # new one instead.
+                handle.close()
+        return True
+
+    def release(self, remove=False):
+        """ Release the lock.
+
+        :param remove: Whether to remove the lock file as well, e.g. once the run is complete.
+        :return: No explicit value returned.
+        """
+        if self.handle is None:
+            return
+        if remove and fcntl is not None:
+            # Removed while still locked, so that no other run can lock the file being removed
+            os.remove(self.path)
+        if fcntl is None:
+            self.handle.seek(0)
+            msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+        self.handle.close()
+        self.handle = None
+        if remove and fcntl is None:
+            try:
+                # Fails when another run has opened the lock file in the meantime, which then keeps it
+                os.remove(self.path)
+            except OSError:
+                pass
@@ -0,0 +1,211 @@
+# coding: utf-8
+# hashcompression.py
+# Copyright 2018 iTtelligent, LLC., Kirby J. Davis (kdavis@itelligentllc.com)
+
+"""This file is part of iTelliHashCSV.
+
+    iTelliHashCSV - A Cryptographic Hashing Application for CSV Files
+    Copyright (C) 2018 iTelligent, LLC (Kirby J. Davis)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+    """
+
+
+import bz2
+import collections
+import functools
+import gzip
+import io
+import lzma
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from hashpipeline import put_unless_stopped, start_thread
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression of a file by its (last) file extension
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.zst': 'zstd'}
+
+
+def compression_of(filepath):
+    """
+    Compression of a file ('gzip', 'bz2', 'xz' or 'zstd') from its file extension, or None if it is not
+    compressed.
+    """
+    if not isinstance(filepath, str):
+        return None
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(filepath)[1].lower())
+
+
+def split_extension(filename):
+    """
+    Like os.path.splitext, but a compression extension is kept together with the extension before it:
+    'data.csv.gz' -> ('data', '.csv.gz').
+    """
+    root, extension = os.path.splitext(filename)
+    if extension.lower() in COMPRESSION_EXTENSIONS:
+        root, inner = os.path.splitext(root)
+        extension = inner + extension
+    return root, extension
+
+
+def compression_extension(compression):
+    """
+    File extension of a compression, or '' for None.
+    """
+    for extension, name in COMPRESSION_EXTENSIONS.items():
+        if name == compression:
+            return extension
+    if compression is not None:
+        raise ValueError('Unknown compression: %r' % (compression,))
+    return ''
+
+
+def compress_block(compression, level, block):
+    """
+    Compress a block of data into a complete, self-contained gzip member, bzip2 stream, xz stream or zstd frame.
+    Such blocks can simply be concatenated: readers of these formats decompress all of them in order.
+    """
+    if compression == 'gzip':
+        return gzip.compress(block, 6 if level is None else level, mtime=0)
+    if compression == 'bz2':
+        return bz2.compress(block, 9 if level is None else level)
+    if compression == 'xz':
+        return lzma.compress(block, preset=level)
+    if zstandard is None:
+        raise ImportError("compression 'zstd' requires the zstandard package")
+    return zstandard.ZstdCompressor(level=3 if level is None else level).compress(block)
+
+
+class ParallelCompressedWriter(io.RawIOBase):
+    """
+    Binary file object that compresses what is written to it in blocks on a pool of threads (the compressors
+    release the GIL), so that compression overlaps with the work of the thread that writes and uses several
+    cores. The compressed blocks are written to the file in order.
+    """
+
+    def __init__(self, filepath, compression, append=False, threads=None, level=None, blocksize=1 << 22):
+        super(ParallelCompressedWriter, self).__init__()
+        self.threads = threads or os.cpu_count() or 1
+        self.compress = functools.partial(compress_block, compression, level)
+        self.blocksize = blocksize
+        self.buffer = bytearray()
+        self.pending = collections.deque()
+        self.pool = ThreadPoolExecutor(self.threads)
+        self.handle = open(filepath, 'ab' if append else 'wb')
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.blocksize:
+            self.submit()
+        return len(data)
+
+    def submit(self):
+        self.pending.append(self.pool.submit(self.compress, bytes(self.buffer)))
+        self.buffer = bytearray()
+        # Bound the memory held by blocks waiting to be compressed or written.
+        while len(self.pending) > 2 * self.threads:
+            self.handle.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.buffer:
+                self.submit()
+            while self.pending:
+                self.handle.write(self.pending.popleft().result())
+        finally:
+            self.pool.shutdown()
+            self.handle.close()
+            super(ParallelCompressedWriter, self).close()
+
+
+class ReadAheadReader(io.RawIOBase):
+    """
+    Binary file object that reads (and so decompresses) a source file object on a background thread, a few
+    blocks ahead of the thread that reads from it.
+    """
+
+    def __init__(self, source, blocksize=1 << 20, depth=8):
+        super(ReadAheadReader, self).__init__()
+        self.blocks = queue.Queue(depth)
+        self.stopped = threading.Event()
+        self.block = memoryview(b'')
+        self.eof = False
+        start_thread(self.read_ahead, source, blocksize, self.blocks, self.stopped)
+
+    @staticmethod
+    def read_ahead(source, blocksize, blocks, stopped):
+        try:
+            while not stopped.is_set():
+                block = source.read(blocksize)
+                put_unless_stopped(blocks, block, stopped)
+                if not block:
+                    break
+        except Exception as error:
+            put_unless_stopped(blocks, error, stopped)
+        finally:
+            source.close()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.block and not self.eof:
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            self.block = memoryview(block)
+            self.eof = not block
+        count = min(len(b), len(self.block))
+        b[:count] = self.block[:count]
+        self.block = self.block[count:]
+        return count
+
+    def close(self):
+        self.stopped.set()
+        super(ReadAheadReader, self).close()
+
+
+def open_compressed(filepath, compression=None):
+    """
+    Open a compressed file for reading, decompressing it on a background thread.
+
+    :param filepath: Path of the compressed file.
+    :param compression: Compression of the file, or None to take it from the file extension.
+    :return: Binary file object of the decompressed data.
+    """
+    compression = compression or compression_of(filepath)
+    if compression == 'gzip':
+        source = gzip.open(filepath, 'rb')
+    elif compression == 'bz2':
+        source = bz2.open(filepath, 'rb')
+    elif compression == 'xz':
+        source = lzma.open(filepath, 'rb')
+    elif zstandard is None:
+        raise ImportError("compression 'zstd' requires the zstandard package")
+    else:
+        source = zstandard.ZstdDecompressor().stream_reader(open(filepath, 'rb'), read_across_frames=True,
+                                                            closefd=True)
+    return io.BufferedReader(ReadAheadReader(source), 1 << 20)
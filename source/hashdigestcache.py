@@ -0,0 +1,170 @@
+# coding: utf-8
+# hashdigestcache.py
+# Copyright 2018 iTtelligent, LLC., Kirby J. Davis (kdavis@itelligentllc.com)
+
+"""This file is part of iTelliHashCSV.
+
+    iTelliHashCSV - A Cryptographic Hashing Application for CSV Files
+    Copyright (C) 2018 iTelligent, LLC (Kirby J. Davis)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+    """
+
+import contextlib
+import sqlite3
+import threading
+import time
+
+CREATE_TABLE = ('CREATE TABLE IF NOT EXISTS digests (algorithm TEXT NOT NULL, plaintext TEXT NOT NULL, '
+                'digest BLOB NOT NULL, lastused INTEGER NOT NULL, PRIMARY KEY (algorithm, plaintext)) WITHOUT ROWID')
+
+class DigestCache(object):
+    """
+    Persistent, on-disk cache of plaintext -> digest per hash format, kept in an SQLite database so that it
+    survives between runs and can be shared by several processes. Entries not used for maxage seconds, and the
+    least recently used entries beyond maxentries, are evicted by evict().
+
+    The entries of a hash format are read into memory on its first lookup, so that looking values up costs no
+    query. The last use of the entries found is written back when the cache is evicted or closed, and only for
+    entries whose recorded last use is more than touchinterval (or maxage) seconds older than the opening of the
+    cache. Eviction counts the age of the entries from the opening of the cache too, so that the entries used
+    by a run are never evicted by it.
+    """
+
+    # Resolution of the last use of the entries, in seconds
+    touchinterval = 24 * 3600
+
+    def __init__(self, cachepath, maxentries=None, maxage=None):
+        self.cachepath = cachepath
+        self.maxentries = maxentries
+        self.maxage = maxage
+        self.hits = 0
+        self.misses = 0
+        self.opened = int(time.time())
+        # Hash format -> {plaintext: digest} of the entries read from the cache, and the plaintexts of the entries
+        # whose last use is more than touchinterval seconds old
+        self.entries = {}
+        self.stale = {}
+        # Hash format -> plaintexts of the entries found whose last use must be written back
+        self.touched = {}
+
+        # The cache is used from the threads of the pipeline (see hashpipeline) as well as from the thread that
+        # opened it; every use of the connection holds the lock.
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(cachepath, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.transaction():
+            self.connection.execute(CREATE_TABLE)
+            self.connection.execute('CREATE INDEX IF NOT EXISTS digests_lastused ON digests (lastused)')
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ Write transaction that takes the write lock up front, so that concurrent processes wait for each other
+            (up to the connection timeout) instead of failing when a read would have to be upgraded to a write.
+        """
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def load(self, algorithm):
+        """ The entries of a hash format, read from the cache on first use.
+
+        :param algorithm: Name of the hash format and key (CSVCryptoHash.digestname).
+        :return: Dictionary of plaintext -> digest.
+        """
+        if algorithm not in self.entries:
+            with self.lock:
+                self.entries[algorithm] = dict(self.connection.execute(
+                    'SELECT plaintext, digest FROM digests WHERE algorithm = ?', (algorithm,)))
+                self.stale[algorithm] = set(plaintext for plaintext, in self.connection.execute(
+                    'SELECT plaintext FROM digests WHERE lastused < ? AND algorithm = ?',
+                    (self.opened - min(self.touchinterval, self.maxage or self.touchinterval), algorithm)))
+        return self.entries[algorithm]
+
+    def lookup(self, algorithm, plaintexts):
+        """ Look up the cached digests of plaintext values and mark the ones found as used.
+
+        :param algorithm: Name of the hash format and key (CSVCryptoHash.digestname).
+        :param plaintexts: List of plaintext strings.
+        :return: List of the hexadecimal digests of the values, None for the values not found in the cache.
+        """
+        entries = self.load(algorithm)
+        digests = [digest if digest is None else digest.hex() for digest in map(entries.get, plaintexts)]
+        stale = self.stale[algorithm]
+        if stale:
+            touched = stale.intersection(plaintexts)
+            stale.difference_update(touched)
+            self.touched.setdefault(algorithm, set()).update(touched)
+        misses = digests.count(None)
+        self.hits += len(digests) - misses
+        self.misses += misses
+        return digests
+
+    def store(self, algorithm, digests):
+        """ Add newly computed digests to the cache.
+
+        :param algorithm: Name of the hash format and key (CSVCryptoHash.digestname).
+        :param digests: Dictionary of plaintext -> hexadecimal digest.
+        :return: No explicit value returned.
+        """
+        now = int(time.time())
+        # Inserted in key order, which is about twice as fast as inserting them in random order
+        rows = sorted((plaintext, bytes.fromhex(digest)) for plaintext, digest in digests.items())
+        with self.transaction():
+            self.connection.executemany('INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?)',
+                                        ((algorithm, plaintext, digest, now) for plaintext, digest in rows))
+        self.load(algorithm).update(rows)
+
+    def touch(self):
+        """ Write back the last use of the entries found by lookup since the previous touch.
+
+        :return: No explicit value returned.
+        """
+        now = int(time.time())
+        with self.transaction():
+            for algorithm, plaintexts in self.touched.items():
+                self.connection.executemany('UPDATE digests SET lastused = ? WHERE algorithm = ? AND plaintext = ?',
+                                            ((now, algorithm, plaintext) for plaintext in plaintexts))
+        self.touched = {}
+
+    def evict(self):
+        """ Remove entries older than maxage seconds and the least recently used entries beyond maxentries.
+
+        :return: No explicit value returned.
+        """
+        # Entries used by this run must not be evicted as unused
+        self.touch()
+        with self.transaction():
+            if self.maxage is not None:
+                self.connection.execute('DELETE FROM digests WHERE lastused < ?', (self.opened - self.maxage,))
+            if self.maxentries is not None:
+                count = self.connection.execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+                if count > self.maxentries:
+                    self.connection.execute('DELETE FROM digests WHERE (algorithm, plaintext) IN '
+                                            '(SELECT algorithm, plaintext FROM digests ORDER BY lastused LIMIT ?)',
+                                            (count - self.maxentries,))
+        self.entries = {}
+        self.stale = {}
+
+    def close(self):
+        if any(self.touched.values()):
+            self.touch()
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,403 @@
+# coding: utf-8
+# hashinstrumentation.py
+# Copyright 2018 iTtelligent, LLC., Kirby J. Davis (kdavis@itelligentllc.com)
+
+"""This file is part of iTelliHashCSV.
+
+    iTelliHashCSV - A Cryptographic Hashing Application for CSV Files
+    Copyright (C) 2018 iTelligent, LLC (Kirby J. Davis)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+    """
+
+
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def current_rss():
+    """
+    Resident set size of this process in bytes, or None where it cannot be measured.
+    """
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def available_memory():
+    """
+    Physical memory in bytes available to new allocations without swapping, or None where it cannot be measured.
+    """
+    try:
+        with open('/proc/meminfo') as handle:
+            for line in handle:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.virtual_memory().available
+
+
+def children_peak_rss():
+    """
+    Largest peak resident set size in bytes of the finished child (worker) processes, or None.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PeakMemory(object):
+    """
+    Samples the resident set size of this process on a background thread, to report the peak of a stage.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.sample)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.update()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.update()
+
+    def update(self):
+        rss = current_rss()
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+
+
+def new_record():
+    """
+    Empty measurements: counters, and measurements per file and per field/column.
+    """
+    return {'counters': {}, 'files': {}, 'fields': {}}
+
+
+def add_measures(measures, values):
+    """
+    Add values to a dictionary of measurements. Numbers are summed; anything else replaces the previous value.
+    """
+    for name, value in values.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and name in measures:
+            measures[name] += value
+        else:
+            measures[name] = value
+
+
+class RunReport(object):
+    """
+    Measurements of one run of CSVCryptoHash: wall time, CPU time and peak memory per stage, and the rows, bytes,
+    distinct values, cache hits... counted per stage, per file and per field/column. Measurements taken outside
+    of a stage (e.g. in a worker process) are kept pending until they are merged into the stage of the parent
+    process. Profiler hooks are told when each stage starts and stops.
+    """
+
+    def __init__(self, hooks=None):
+        self.hooks = list(hooks or [])
+        self.started = time.time()
+        self.stages = []
+        self.current = None
+        self.pending = new_record()
+
+    def target(self):
+        return self.pending if self.current is None else self.current
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ Measure a stage. Stages started within a stage are measured as part of the outer stage. """
+        if self.current is not None:
+            yield self.current
+            return
+        self.current = record = new_record()
+        record['stage'] = name
+        for hook in self.hooks:
+            hook.start_stage(name)
+        try:
+            with PeakMemory() as memory:
+                wall = time.perf_counter()
+                cpu = time.process_time()
+                yield record
+                record['cpu_seconds'] = time.process_time() - cpu
+                record['seconds'] = time.perf_counter() - wall
+        finally:
+            self.current = None
+            for hook in self.hooks:
+                hook.stop_stage(name, record)
+        record['peak_rss_mb'] = None if memory.peak is None else memory.peak / 1e6
+        children = children_peak_rss()
+        if children:
+            record['children_peak_rss_mb'] = children / 1e6
+        self.stages.append(record)
+
+    def count(self, name, value=1):
+        """ Add to a counter of the current stage. """
+        add_measures(self.target()['counters'], {name: value})
+
+    def add_file(self, file, **measures):
+        """ Add measurements of an input file (or a part of it) to the current stage. """
+        add_measures(self.target()['files'].setdefault(file, {}), measures)
+
+    def add_field(self, field, **measures):
+        """ Add measurements of a field/column to the current stage. """
+        add_measures(self.target()['fields'].setdefault(field, {}), measures)
+
+    def take_pending(self):
+        """ Measurements taken outside of a stage, which are then cleared (see merge). """
+        pending, self.pending = self.pending, new_record()
+        return pending
+
+    def merge(self, record):
+        """ Add the measurements returned by take_pending (e.g. in a worker process) to the current stage. """
+        add_measures(self.target()['counters'], record['counters'])
+        for kind in ('files', 'fields'):
+            for name, measures in record[kind].items():
+                add_measures(self.target()[kind].setdefault(name, {}), measures)
+
+    def to_dict(self, **info):
+        """ The report as a JSON serializable dictionary, with additional top level information. """
+        report = dict(info)
+        report['started'] = time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started))
+        report['seconds'] = time.time() - self.started
+        report['stages'] = self.stages
+        return report
+
+    def write(self, path, **info):
+        """ Write the report as JSON. """
+        with open(path, 'w') as handle:
+            json.dump(self.to_dict(**info), handle, indent=1, sort_keys=True)
+
+
+def instrumented_stage(method):
+    """
+    Decorator for CSVCryptoHash methods that are stages of a run, measured by its RunReport (self.report) and
+    tracked by its Progress (self.progress).
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.report.stage(method.__name__), self.progress.stage(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class ProfilerHook(object):
+    """
+    Base class of the profiler hooks of a RunReport: start_stage and stop_stage are called around every stage.
+    """
+
+    def start_stage(self, stage):
+        pass
+
+    def stop_stage(self, stage, record):
+        pass
+
+
+class CProfileHook(ProfilerHook):
+    """
+    Profiles every stage with cProfile and writes the statistics to <directory>/<stage>.prof, for use with
+    pstats, snakeviz...
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.profile = None
+
+    def start_stage(self, stage):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop_stage(self, stage, record):
+        self.profile.disable()
+        path = os.path.join(self.directory, stage + '.prof')
+        self.profile.dump_stats(path)
+        record['profile'] = path
+        self.profile = None
+
+
+# Relative duration of the stages of a run, used to combine their progress into the progress of the run. The stages
+# reading all of the input files take about as long as each other; writing the 'mapfiles' takes a fraction of that.
+STAGE_WEIGHTS = {'create_temp_db': 4, 'create_summary_hash_mapfile': 1, 'create_column_hash_mapfile': 1,
+                 'create_hashed_version_of_input': 4, 'create_outputs_single_pass': 1,
+                 'create_outputs_incremental': 1}
+
+
+class Progress(object):
+    """
+    Progress of a run, reported to callback(info) at most every interval seconds (and at the start and end of
+    every stage). Stages report the bytes of input they will read, or the rows they will write, and advance
+    towards that total. info is a dictionary with:
+    stage, bytes, totalbytes, rows, totalrows, fraction (of the stage, or None if unknown),
+    runfraction (of the stages given to plan), elapsed and eta (seconds remaining in the run, or None).
+    """
+
+    def __init__(self, callback=None, interval=0.5):
+        self.callback = callback
+        self.interval = interval
+        self.planned = []
+        self.finished = []
+        self.started = time.time()
+        self.current = None
+        self.stagedone = False
+        self.bytes = self.rows = 0
+        self.totalbytes = self.totalrows = None
+        self.notified = 0.0
+
+    def plan(self, stages):
+        """ Stages (method names) the run will go through, to report the progress of the run as a whole. """
+        self.planned = list(stages)
+        self.finished = []
+        self.started = time.time()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ Track a stage. Stages started within a stage are tracked as part of the outer stage. """
+        if self.current is not None:
+            yield
+            return
+        self.current = name
+        self.stagedone = False
+        self.bytes = self.rows = 0
+        self.totalbytes = self.totalrows = None
+        try:
+            yield
+        finally:
+            self.stagedone = True
+            self.finished.append(name)
+            self.notify(True)
+            self.current = None
+
+    def start(self, totalbytes=None, totalrows=None):
+        """ Total of the current stage: bytes of input it reads, or rows it writes. """
+        self.totalbytes = totalbytes
+        self.totalrows = totalrows
+        self.notify(True)
+
+    def advance(self, bytes=0, rows=0):
+        """ Bytes and rows of the current stage that are done. """
+        if self.callback is None:
+            return
+        self.bytes += bytes
+        self.rows += rows
+        self.notify()
+
+    def file(self, totalbytes, rowbytes):
+        """ FileProgress of an input file of totalbytes bytes with rows of about rowbytes bytes. """
+        return FileProgress(self, totalbytes, rowbytes)
+
+    def fraction(self):
+        """ Fraction of the current stage that is done, or None if it is not known. """
+        if self.stagedone:
+            return 1.0
+        if self.totalbytes:
+            return min(1.0, self.bytes / float(self.totalbytes))
+        if self.totalrows:
+            return min(1.0, self.rows / float(self.totalrows))
+        return None
+
+    def run_fraction(self):
+        """ Fraction of the planned stages that is done, weighted by STAGE_WEIGHTS. """
+        fraction = self.fraction() or 0.0
+        if self.current not in self.planned:
+            return fraction
+        weights = [STAGE_WEIGHTS.get(stage, 1) for stage in self.planned]
+        # The current stage is counted by its fraction, also once it is finished
+        finished = self.finished[:-1] if self.stagedone else self.finished
+        done = sum(w for stage, w in zip(self.planned, weights) if stage in finished)
+        return min(1.0, (done + STAGE_WEIGHTS.get(self.current, 1) * fraction) / float(sum(weights)))
+
+    def notify(self, force=False):
+        if self.callback is None or self.current is None:
+            return
+        now = time.time()
+        if not force and now - self.notified < self.interval:
+            return
+        self.notified = now
+        elapsed = now - self.started
+        runfraction = self.run_fraction()
+        eta = elapsed * (1 - runfraction) / runfraction if runfraction > 0.001 else None
+        self.callback({'stage': self.current, 'bytes': self.bytes, 'totalbytes': self.totalbytes,
+                       'rows': self.rows, 'totalrows': self.totalrows, 'fraction': self.fraction(),
+                       'runfraction': runfraction, 'elapsed': elapsed, 'eta': eta})
+
+
+class FileProgress(object):
+    """
+    Progress through one input file (or part of it): while it is read, the bytes done are estimated from the
+    rows read; once it is done, its exact size is reported.
+    """
+
+    def __init__(self, progress, totalbytes, rowbytes):
+        self.progress = progress
+        self.totalbytes = totalbytes
+        self.rowbytes = rowbytes
+        self.reported = 0
+
+    def advance(self, rows):
+        estimate = min(self.totalbytes, self.reported + int(rows * self.rowbytes))
+        self.progress.advance(estimate - self.reported, rows)
+        self.reported = estimate
+
+    def done(self, rows=0):
+        self.progress.advance(self.totalbytes - self.reported, rows)
+        self.reported = self.totalbytes
+
+
+def format_duration(seconds):
+    """
+    Duration for display, e.g. '2h 05m', '4m 10s' or '12s'.
+    """
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return '%dh %02dm' % (seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return '%dm %02ds' % (seconds // 60, seconds % 60)
+    return '%ds' % seconds
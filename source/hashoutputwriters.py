@@ -0,0 +1,172 @@
+# coding: utf-8
+# hashoutputwriters.py
+# Copyright 2018 iTtelligent, LLC., Kirby J. Davis (kdavis@itelligentllc.com)
+
+"""This file is part of iTelliHashCSV.
+
+    iTelliHashCSV - A Cryptographic Hashing Application for CSV Files
+    Copyright (C) 2018 iTelligent, LLC (Kirby J. Davis)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+    """
+
+import io
+import os
+
+from hashcompression import ParallelCompressedWriter
+from lazyimport import optional_module
+
+pa = optional_module('pyarrow')
+paipc = optional_module('pyarrow.ipc')
+pq = optional_module('pyarrow.parquet')
+
+# File extension of every output format
+OUTPUT_EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+class OutputWriter(object):
+    """
+    Base class of the output writers, which write DataFrames one after the other to an output file and are
+    closed once all of them are written.
+    """
+
+    def write(self, df):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def abort(self):
+        """ Close the output file after a failed run, ignoring any further error. """
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class CSVOutputWriter(OutputWriter):
+    """
+    Writes DataFrames one after the other to a CSV output file, exactly like a single DataFrame.to_csv of all
+    of them would. With a compression ('gzip', 'bz2', 'xz' or 'zstd'), the output is compressed on threads
+    (see ParallelCompressedWriter) while the next DataFrames are prepared.
+    """
+
+    def __init__(self, outputpath, delimiter, append=False, header=True, compression=None, threads=None,
+                 level=None):
+        self.outputpath = outputpath
+        self.delimiter = delimiter
+        self.mode = 'a' if append else 'w'
+        self.header = header
+        self.handle = None
+        if compression is not None:
+            self.handle = io.TextIOWrapper(io.BufferedWriter(
+                ParallelCompressedWriter(outputpath, compression, append, threads, level), 1 << 20),
+                encoding='utf-8', newline='')
+
+    def write(self, df):
+        df.to_csv(self.handle or self.outputpath, index=False, encoding='utf-8', sep=self.delimiter,
+                  header=self.header, mode=self.mode)
+        self.mode = 'a'
+        self.header = False
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+
+
+class ColumnarOutputWriter(OutputWriter):
+    """
+    Writes DataFrames one after the other to a Parquet or Arrow IPC output file. Hash value columns are stored
+    as fixed-size binary digests, all other columns as strings. When appending, the rows already in the file
+    are copied to the new file first, since neither format can be appended to in place.
+    """
+
+    def __init__(self, outputpath, outputformat, digestcolumns, digestsize, compression='zstd', append=False):
+        if pa is None:
+            raise ImportError("outputformat '%s' requires the pyarrow package" % outputformat)
+        self.outputpath = outputpath
+        self.outputformat = outputformat
+        self.digestcolumns = set(digestcolumns)
+        self.digesttype = pa.binary(digestsize)
+        self.compression = compression
+        self.writer = None
+        self.previous = None
+        if append and os.path.exists(outputpath):
+            self.previous = outputpath + '.previous'
+            os.replace(outputpath, self.previous)
+
+    def write(self, df):
+        arrays = []
+        for column in df.columns:
+            values = [v if isinstance(v, str) else None for v in df[column]]
+            if column in self.digestcolumns:
+                arrays.append(pa.array([None if v is None else bytes.fromhex(v) for v in values],
+                                       type=self.digesttype))
+            else:
+                arrays.append(pa.array(values, type=pa.string()))
+        table = pa.Table.from_arrays(arrays, names=[str(c) for c in df.columns])
+        if self.writer is None:
+            self.open(table.schema)
+        self.writer.write_table(table)
+
+    def open(self, schema):
+        if self.outputformat == 'parquet':
+            self.writer = pq.ParquetWriter(self.outputpath, schema, compression=self.compression)
+        else:
+            options = paipc.IpcWriteOptions(compression=self.compression)
+            self.writer = paipc.new_file(self.outputpath, schema, options=options)
+        if self.previous is not None:
+            for batch in read_columnar_batches(self.previous, self.outputformat):
+                self.writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+            os.remove(self.previous)
+            self.previous = None
+
+    def close(self):
+        if self.previous is not None:
+            os.replace(self.previous, self.outputpath)
+        if self.writer is not None:
+            self.writer.close()
+
+
+def read_columnar_batches(path, outputformat, columns=None, batchsize=65536):
+    """
+    Record batches of a Parquet or Arrow IPC file.
+    """
+    if outputformat == 'parquet':
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batchsize, columns=columns):
+            yield batch
+        return
+    with pa.memory_map(path) as source:
+        reader = paipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            yield batch if columns is None else batch.select(columns)
+
+
+def join_columnar_parts(outputpath, partpaths, outputformat, compression='zstd'):
+    """
+    Concatenate partial Parquet or Arrow IPC output files, in order, into one output file and remove them.
+    """
+    if outputformat == 'parquet':
+        writer = pq.ParquetWriter(outputpath, pq.read_schema(partpaths[0]), compression=compression)
+    else:
+        with pa.memory_map(partpaths[0]) as source:
+            schema = paipc.open_file(source).schema
+        writer = paipc.new_file(outputpath, schema, options=paipc.IpcWriteOptions(compression=compression))
+    for partpath in partpaths:
+        for batch in read_columnar_batches(partpath, outputformat):
+            writer.write_table(pa.Table.from_batches([batch]))
+    writer.close()
+    for partpath in partpaths:
+        os.remove(partpath)
@@ -0,0 +1,222 @@
+# coding: utf-8
+# hashpipeline.py
+# Copyright 2018 iTtelligent, LLC., Kirby J. Davis (kdavis@itelligentllc.com)
+
+"""This file is part of iTelliHashCSV.
+
+    iTelliHashCSV - A Cryptographic Hashing Application for CSV Files
+    Copyright (C) 2018 iTelligent, LLC (Kirby J. Davis)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+    """
+
+import queue
+import threading
+
+
+def start_thread(target, *args):
+    """
+    Start a daemon thread running target(*args). target must not refer to the object that owns the thread (use a
+    staticmethod), so that an abandoned owner can still be garbage collected (and closed, which stops the thread).
+    """
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def put_unless_stopped(items, item, stopped):
+    """
+    Put item in the bounded queue items, waiting for room until the stopped event is set.
+
+    :return: Whether the item was put.
+    """
+    while not stopped.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def discard(items):
+    """
+    Remove the items waiting in a queue, so that their memory is freed and a thread waiting to put one goes on.
+    """
+    while True:
+        try:
+            items.get_nowait()
+        except queue.Empty:
+            return
+
+
+def close_source(*sources):
+    """
+    Close the sources (iterators, pandas readers...) that have a close method, e.g. to release their file handle.
+    """
+    for source in sources:
+        if hasattr(source, 'close'):
+            source.close()
+
+
+class Prefetcher(object):
+    """
+    Iterator over the items of a source iterator produced on a background thread, at most depth items ahead of
+    the consumer, so that producing the next item (reading and parsing a chunk, hashing a file...) overlaps with
+    the consumer's work on the current one. Exceptions raised by the source are raised to the consumer. A bounded
+    queue provides the backpressure: the producer waits while depth items are waiting to be consumed.
+
+    Use it as a context manager (or call close) so that the thread is stopped and the source closed when the
+    consumer stops early or fails.
+    """
+
+    def __init__(self, source, depth=2):
+        self.items = queue.Queue(depth)
+        self.stopped = threading.Event()
+        self.done = False
+        self.thread = start_thread(self.produce, source, self.items, self.stopped)
+
+    @staticmethod
+    def produce(source, items, stopped):
+        iterator = iter(source)
+        try:
+            for item in iterator:
+                put_unless_stopped(items, (item, None), stopped)
+                if stopped.is_set():
+                    break
+            put_unless_stopped(items, (None, StopIteration()), stopped)
+        except BaseException as error:
+            put_unless_stopped(items, (None, error), stopped)
+        finally:
+            close_source(iterator, source)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        item, error = self.items.get()
+        if error is not None:
+            self.done = True
+            self.thread.join()
+            raise error
+        return item
+
+    def close(self):
+        """ Stop the producer, e.g. when the consumer stops early or fails, and wait for it to finish. """
+        self.done = True
+        self.stopped.set()
+        discard(self.items)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.stopped.set()
+
+
+class DirectIterator(object):
+    """
+    Iterator over the items of a source iterator on the consumer's thread, with the close and context manager
+    methods of a Prefetcher.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.iterator = iter(source)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.iterator)
+
+    def close(self):
+        close_source(self.iterator, self.source)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def prefetch(source, depth=2):
+    """
+    Iterate over source on a background thread (see Prefetcher), or directly when depth is 0 (see DirectIterator).
+    """
+    if depth <= 0:
+        return DirectIterator(source)
+    return Prefetcher(source, depth)
+
+
+class BackgroundWriter(object):
+    """
+    Output writer (see hashoutputwriters) wrapper that writes on a background thread, so that formatting,
+    compressing and writing a DataFrame overlaps with producing the next one. At most depth DataFrames wait to be
+    written; write blocks when the writer falls behind. An error of the writer is raised by the next write or by
+    close. When the run fails, abort stops the thread and closes the writer without waiting for the DataFrames.
+    """
+
+    def __init__(self, writer, depth=2):
+        self.writer = writer
+        self.frames = queue.Queue(depth)
+        self.errors = []
+        self.stopped = threading.Event()
+        self.thread = start_thread(self.consume, writer, self.frames, self.errors, self.stopped)
+
+    @staticmethod
+    def consume(writer, frames, errors, stopped):
+        while not stopped.is_set():
+            try:
+                frame = frames.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if frame is None:
+                break
+            if not errors:
+                # After an error, the remaining frames are only drained so that write never blocks forever
+                try:
+                    writer.write(frame)
+                except BaseException as error:
+                    errors.append(error)
+
+    def write(self, frame):
+        if self.errors:
+            raise self.errors[0]
+        self.frames.put(frame)
+
+    def close(self):
+        """ Wait for the waiting DataFrames to be written and close the writer. """
+        self.frames.put(None)
+        self.thread.join()
+        self.writer.close()
+        if self.errors:
+            raise self.errors[0]
+
+    def abort(self):
+        """ Stop writing, discard the waiting DataFrames and close the writer, ignoring any further error. """
+        self.stopped.set()
+        discard(self.frames)
+        self.thread.join()
+        self.writer.abort()
+
+    def __del__(self):
+        self.stopped.set()
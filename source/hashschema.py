@@ -0,0 +1,130 @@
+# coding: utf-8
+# hashschema.py
+# Copyright 2018 iTtelligent, LLC., Kirby J. Davis (kdavis@itelligentllc.com)
+
+"""This file is part of iTelliHashCSV.
+
+    iTelliHashCSV - A Cryptographic Hashing Application for CSV Files
+    Copyright (C) 2018 iTelligent, LLC (Kirby J. Davis)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+    """
+
+import csv
+
+from hashcompression import compression_of, open_compressed
+
+# Delimiters and quote characters considered when sniffing the dialect of an input file
+SNIFF_DELIMITERS = ',;\t|'
+SNIFF_QUOTECHARS = '"\''
+
+
+def sniff_dialect(filepath, default=(',', '"'), samplebytes=1 << 16, samplelines=20):
+    """
+    Sniff the delimiter and quote character of a CSV file (which may be compressed) from its first lines.
+
+    :param default: (delimiter, quotechar) returned when the dialect cannot be told from the sample.
+    :return: (delimiter, quotechar)
+    """
+    with open_compressed(filepath) if compression_of(filepath) else open(filepath, 'rb') as handle:
+        sample = handle.read(samplebytes)
+    # Lines are rejoined with \n: csv.Sniffer does not recognize quoted values at the end of \r\n lines
+    lines = sample.decode('utf-8', 'replace').splitlines()
+    if len(lines) > 1:
+        # Leave out the last line, which may be cut off
+        lines = lines[:-1]
+    lines = lines[:samplelines]
+    try:
+        dialect = csv.Sniffer().sniff('\n'.join(lines), delimiters=SNIFF_DELIMITERS)
+    except csv.Error:
+        return default
+    # The sniffer also takes a quote inside a value (e.g. "it's") for a quote character: only keep one that opens a
+    # value somewhere in the sample.
+    quotechar = dialect.quotechar
+    opens = any(line.startswith(quotechar) or dialect.delimiter + quotechar in line for line in lines)
+    if quotechar not in SNIFF_QUOTECHARS or not opens:
+        quotechar = default[1]
+    return dialect.delimiter, quotechar
+
+
+class FileSchema(object):
+    """
+    What the catalog knows about one input file: its column names and the fields/columns to process in it.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.plans = {}
+
+    def fields(self, fields2hash):
+        """ Fields/columns selected for hashing that the file has, in the order of its columns. """
+        key = tuple(sorted(fields2hash))
+        if key not in self.plans:
+            selected = set(fields2hash)
+            self.plans[key] = [column for column in self.columns if column in selected]
+        return list(self.plans[key])
+
+
+class SchemaCatalog(object):
+    """
+    Per-run catalog of the input files: the header of every file is read once, and its dialect sniffed at most
+    once, however many stages need them. Entries depend on the reading settings (delimiter, quote character...),
+    which are part of their key, so that changing a setting never returns stale column names. clear() starts a
+    new run.
+
+    :param readcolumns: Function returning the column names of an input file with the current settings.
+    :param settings: Function returning the current reading settings (any hashable value).
+    """
+
+    def __init__(self, readcolumns, settings):
+        self.readcolumns = readcolumns
+        self.settings = settings
+        self.schemas = {}
+        self.dialects = {}
+
+    def schema(self, filepath):
+        """ FileSchema of an input file. """
+        key = (filepath, self.settings())
+        if key not in self.schemas:
+            self.schemas[key] = FileSchema(list(self.readcolumns(filepath)))
+        return self.schemas[key]
+
+    def columns(self, filepath):
+        """ Column names of an input file. """
+        return list(self.schema(filepath).columns)
+
+    def fields(self, filepath, fields2hash):
+        """ Fields/columns selected for hashing found in an input file, in the order of its columns. A file may
+            lack some of them, but not have them under a name that only differs by a byte order mark or
+            surrounding whitespace: that column would be left unhashed, so ValueError is raised instead.
+        """
+        schema = self.schema(filepath)
+        fields = schema.fields(fields2hash)
+        missing = set(fields2hash).difference(fields)
+        lookalikes = [column for column in schema.columns if str(column).strip(u'\ufeff \t') in missing]
+        if lookalikes:
+            raise ValueError('%s: column(s) %s do not match the selected field(s) exactly and would not be hashed'
+                             % (filepath, ', '.join(repr(column) for column in lookalikes)))
+        return fields
+
+    def dialect(self, filepath):
+        """ (delimiter, quotechar) sniffed from a CSV input file, see sniff_dialect. """
+        if filepath not in self.dialects:
+            self.dialects[filepath] = sniff_dialect(filepath)
+        return self.dialects[filepath]
+
+    def clear(self):
+        """ Forget every file, e.g. once a run is complete. """
+        self.schemas = {}
+        self.dialects = {}
@@ -0,0 +1,340 @@
+# coding: utf-8
+# itellihashbench.py
+# Copyright 2018 iTtelligent, LLC., Kirby J. Davis (kdavis@itelligentllc.com)
+
+"""This file is part of iTelliHashCSV.
+
+    iTelliHashCSV - A Cryptographic Hashing Application for CSV Files
+    Copyright (C) 2018 iTelligent, LLC (Kirby J. Davis)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+    """
+
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+import csvcryptohashinglogic as chl
+from hashinstrumentation import PeakMemory
+
+# Stages of the four stage SQLite pipeline, in order, and the single-pass engine
+SQLITE_STAGES = ('create_temp_db', 'create_summary_hash_mapfile', 'create_column_hash_mapfile',
+                 'create_hashed_version_of_input')
+SINGLE_PASS_STAGES = ('create_outputs_single_pass',)
+# The 'hash' engine only measures the hashing of the values of the hashed columns
+HASH_STAGES = ('hash_many',)
+
+# Key used to benchmark the keyed (BLAKE2) and HMAC versions of the hash formats
+BENCHMARK_KEY = bytes(range(32))
+
+
+def generate_csv(filepath, rows, columns, cardinality, strlen, quoting=0.0, nulls=0.0, delimiter=',', seed=0):
+    """ Write a synthetic CSV file. Every column draws its values from its own pool of distinct random strings,
+        so the number of distinct values per column (and so the size of the 'mapfiles') is controlled.
+
+    :param filepath: Path of the CSV file to write.
+    :param rows: Number of rows.
+    :param columns: Number of columns, named col0, col1...
+    :param cardinality: Number of distinct values per column.
+    :param strlen: Length of the values.
+    :param quoting: Fraction of the values that contain the delimiter, a quote or a line break (and so are quoted).
+    :param nulls: Fraction of the values that are empty (missing).
+    :param delimiter: Field delimiter.
+    :param seed: Random seed; the same arguments always produce the same file.
+    :return: No explicit value returned.
+    """
+    rng = random.Random(seed)
+    specials = [delimiter, '"', '\n']
+    pools = []
+    for _ in range(columns):
+        pool = []
+        for _ in range(cardinality):
+            value = ''.join(rng.choice(string.ascii_letters + string.digits) for _ in range(strlen))
+            if rng.random() < quoting:
+                position = rng.randrange(len(value) + 1)
+                value = value[:position] + rng.choice(specials) + value[position:]
+            pool.append(value)
+        pools.append(pool)
+    with open(filepath, 'w', newline='', encoding='utf-8') as handle:
+        writer = csv.writer(handle, delimiter=delimiter, lineterminator='\n')
+        writer.writerow(['col%d' % k for k in range(columns)])
+        for _ in range(rows):
+            writer.writerow(['' if nulls and rng.random() < nulls else rng.choice(pool) for pool in pools])
+
+
+def run_stage(mychl, stage, arguments, inputrows, inputbytes):
+    """ Run one stage and measure it.
+
+    :return: Dictionary of measurements.
+    """
+    with PeakMemory() as memory:
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        getattr(mychl, stage)(*arguments)
+        cpu = time.process_time() - cpu
+        wall = time.perf_counter() - wall
+    return {'stage': stage, 'seconds': wall, 'cpu_seconds': cpu, 'rows': inputrows, 'bytes': inputbytes,
+            'rows_per_second': inputrows / wall if wall else None,
+            'mb_per_second': inputbytes / 1e6 / wall if wall else None,
+            'peak_rss_mb': None if memory.peak is None else memory.peak / 1e6}
+
+
+def run_benchmark(inputdirectory, files, fields2hash, algorithm, engine, settings, inputrows, keyed=False,
+                  cachepath=None):
+    """ Run all stages of one engine for one hash format on the generated files.
+
+    :param engine: 'sqlite' (the four stage pipeline), 'single-pass' or 'hash' (hashing the values of the hashed
+                   columns only, which measures the throughput of the hash format itself).
+    :param keyed: Whether to benchmark the keyed (BLAKE2) or HMAC version of the hash format.
+    :param settings: Dictionary of CSVCryptoHash attributes to set (workers, chunksize, csvengine...).
+    :param cachepath: Persistent digest cache to use, or None.
+    :return: List of measurement dictionaries, one per stage.
+    """
+    inputbytes = sum(os.path.getsize(os.path.join(inputdirectory, file)) for file in files)
+    outputdirectory = tempfile.mkdtemp(prefix='itellihashbench-')
+    try:
+        mychl = chl.CSVCryptoHash()
+        for name, value in settings.items():
+            setattr(mychl, name, value)
+        mychl.cachepath = cachepath
+        if keyed:
+            mychl.hashkey = BENCHMARK_KEY
+        mychl.identify_hash(chl.HASH_FORMATS[algorithm])
+        fileextension = '.csv'
+        outputdirectory += os.sep
+        calls = {'create_temp_db': (files, fields2hash, inputdirectory),
+                 'create_summary_hash_mapfile': (fileextension, outputdirectory),
+                 'create_column_hash_mapfile': (files, fields2hash, fileextension, inputdirectory, outputdirectory),
+                 'create_hashed_version_of_input': (files, fields2hash, fileextension, inputdirectory,
+                                                    outputdirectory),
+                 'create_outputs_single_pass': (files, fields2hash, fileextension, inputdirectory,
+                                                outputdirectory)}
+        stages = {'sqlite': SQLITE_STAGES, 'single-pass': SINGLE_PASS_STAGES, 'hash': HASH_STAGES}[engine]
+        if engine == 'sqlite':
+            mychl.initialize_sqlite()
+        if engine == 'hash':
+            values = []
+            for file in files:
+                frame = mychl.read_csv(os.path.join(inputdirectory, file), usecols=fields2hash)
+                for field in fields2hash:
+                    values.extend(frame[field].dropna())
+            calls['hash_many'] = (values,)
+            inputrows = len(values)
+            inputbytes = sum(len(value.encode()) for value in values)
+        results = []
+        for stage in stages:
+            recorded = len(mychl.report.stages)
+            result = run_stage(mychl, stage, calls[stage], inputrows, inputbytes)
+            result.update(algorithm=mychl.hstr, engine=engine, implementation=mychl.hashimplementation)
+            if cachepath is not None:
+                # The 'hash' engine does not run a stage, its counters are left pending
+                if len(mychl.report.stages) > recorded:
+                    counters = mychl.report.stages[-1]['counters']
+                else:
+                    counters = mychl.report.take_pending()['counters']
+                for counter in ('cache_hits', 'cache_misses', 'cache_bypassed'):
+                    result[counter] = counters.get(counter, 0)
+            results.append(result)
+        if engine == 'sqlite':
+            mychl.remove_sqlite()
+        mychl.close_digest_cache()
+        return results
+    finally:
+        shutil.rmtree(outputdirectory, ignore_errors=True)
+
+
+def environment():
+    """ Description of the environment the benchmark ran in, to tell results of different versions apart. """
+    description = {'python': platform.python_version(), 'platform': platform.platform(),
+                   'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+    try:
+        description['commit'] = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        description['commit'] = None
+    for module in ('pandas', 'numpy', 'sqlalchemy', 'pyarrow'):
+        try:
+            description[module] = __import__(module).__version__
+        except ImportError:
+            description[module] = None
+    return description
+
+
+def engine_label(result):
+    """ Engine of a result, with the digest cache scenario (cold or warm) when there is one. """
+    return result['engine'] + ('/' + result['cache'] if result.get('cache') else '')
+
+
+def compare(previous, current, threshold=0.1):
+    """ Compare the results of two benchmark runs stage by stage.
+
+    :param previous: Benchmark report (as written by main) to compare against.
+    :param current: Benchmark report of this run.
+    :param threshold: Relative slow down (or memory growth) reported as a regression.
+    :return: List of lines describing the differences; regressions are marked with REGRESSION.
+    """
+    def key(result):
+        return engine_label(result), result['algorithm'], result['stage']
+
+    before = dict((key(result), result) for result in previous['results'])
+    lines = []
+    for result in current['results']:
+        old = before.get(key(result))
+        if old is None:
+            continue
+        for measure, larger_is_better in (('rows_per_second', True), ('peak_rss_mb', False)):
+            if not old.get(measure) or not result.get(measure):
+                continue
+            change = result[measure] / old[measure] - 1
+            worse = -change if larger_is_better else change
+            engine, algorithm, stage = key(result)
+            lines.append('%-18s %-14s %-32s %-16s %+7.1f%%' % (engine, algorithm, stage, measure, 100 * change) +
+                         ('  REGRESSION' if worse > threshold else ''))
+    return lines
+
+
+def parse_arguments(argv=None):
+    """ Command line arguments: generator parameters, hash formats, engines, settings and report options.
+
+    :param argv: Arguments, or None for sys.argv[1:].
+    :return: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        description='Benchmark the iTelliHashCSV stages on synthetic CSV files. Prints (or writes) a JSON report '
+                    'with rows/s, MB/s and peak RSS per engine, hash format and stage.')
+    parser.add_argument('--rows', type=int, default=100000, help='rows per file (default: %(default)s)')
+    parser.add_argument('--files', type=int, default=2, help='number of files (default: %(default)s)')
+    parser.add_argument('--columns', type=int, default=6, help='columns per file (default: %(default)s)')
+    parser.add_argument('--hashed-columns', type=int, default=3,
+                        help='number of columns to hash (default: %(default)s)')
+    parser.add_argument('--cardinality', type=int, default=10000,
+                        help='distinct values per column (default: %(default)s)')
+    parser.add_argument('--strlen', type=int, default=16, help='length of the values (default: %(default)s)')
+    parser.add_argument('--quoting', type=float, default=0.05,
+                        help='fraction of values that need quoting (default: %(default)s)')
+    parser.add_argument('--nulls', type=float, default=0.01,
+                        help='fraction of missing values (default: %(default)s)')
+    parser.add_argument('--delimiter', default=',', help='field delimiter (default: %(default)r)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: %(default)s)')
+    parser.add_argument('--algorithms', default=','.join(sorted(chl.HASH_FORMATS)),
+                        help='comma separated hash formats (default: all)')
+    parser.add_argument('--keyed', action='store_true',
+                        help='benchmark the keyed (BLAKE2) and HMAC versions of the hash formats')
+    parser.add_argument('--engines', default='hash,sqlite,single-pass',
+                        help='comma separated engines: hash (hashing only), sqlite, single-pass '
+                             '(default: %(default)s)')
+    parser.add_argument('--cache', action='store_true',
+                        help='also run every benchmark with a cold and then a warm persistent digest cache; add '
+                             '--set cachemode=always to use the cache for every hash format')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='run every benchmark this many times and keep the fastest (default: %(default)s)')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='CSVCryptoHash setting, e.g. workers=4 or chunksize=50000; VALUE is read as JSON '
+                             'when possible')
+    parser.add_argument('--output', metavar='PATH', help='write the JSON report to PATH instead of stdout')
+    parser.add_argument('--compare', metavar='PATH', help='compare with an earlier JSON report')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change reported as a regression by --compare (default: %(default)s)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Generate the input files, run the benchmarks and write the report.
+
+    :param argv: Arguments, or None for sys.argv[1:].
+    :return: Exit status; 1 when --compare found a regression.
+    """
+    arguments = parse_arguments(argv)
+    settings = {}
+    for setting in arguments.set:
+        name, _, value = setting.partition('=')
+        try:
+            settings[name] = json.loads(value)
+        except ValueError:
+            settings[name] = value
+    settings.setdefault('inputdelimiter', arguments.delimiter)
+
+    parameters = dict((name, getattr(arguments, name)) for name in ('rows', 'files', 'columns', 'hashed_columns',
+                                                                     'cardinality', 'strlen', 'quoting', 'nulls',
+                                                                     'delimiter', 'seed', 'repeat', 'keyed',
+                                                                     'cache'))
+    report = {'environment': environment(), 'parameters': parameters, 'settings': settings, 'results': []}
+    inputdirectory = tempfile.mkdtemp(prefix='itellihashbench-input-')
+    try:
+        files = []
+        for k in range(arguments.files):
+            files.append('bench%d.csv' % k)
+            generate_csv(os.path.join(inputdirectory, files[-1]), arguments.rows, arguments.columns,
+                         arguments.cardinality, arguments.strlen, arguments.quoting, arguments.nulls,
+                         arguments.delimiter, arguments.seed + k)
+        fields2hash = ['col%d' % k for k in range(min(arguments.hashed_columns, arguments.columns))]
+        # The cold cache scenario starts every repetition with an empty cache, which the warm scenario then reuses
+        cachepath = os.path.join(inputdirectory, 'digestcache.db')
+        for engine in arguments.engines.split(','):
+            for algorithm in arguments.algorithms.split(','):
+                for cache in (None, 'cold', 'warm') if arguments.cache else (None,):
+                    best = None
+                    for _ in range(max(1, arguments.repeat)):
+                        if cache == 'cold':
+                            for path in (cachepath, cachepath + '-wal', cachepath + '-shm'):
+                                if os.path.exists(path):
+                                    os.remove(path)
+                        results = run_benchmark(inputdirectory + os.sep, files, fields2hash, algorithm, engine,
+                                                settings, arguments.rows * arguments.files, arguments.keyed,
+                                                None if cache is None else cachepath)
+                        if best is None or sum(r['seconds'] for r in results) < sum(r['seconds'] for r in best):
+                            best = results
+                    for result in best:
+                        result['cache'] = cache
+                        sys.stderr.write('%-18s %-14s %-32s %8.2fs %12.0f rows/s %8.2f MB/s %8.1f MB peak' %
+                                         (engine_label(result), result['algorithm'], result['stage'],
+                                          result['seconds'], result['rows_per_second'] or 0,
+                                          result['mb_per_second'] or 0, result['peak_rss_mb'] or 0))
+                        if cache is not None:
+                            sys.stderr.write(' %8d hits %8d misses %8d bypassed' %
+                                             (result['cache_hits'], result['cache_misses'], result['cache_bypassed']))
+                        sys.stderr.write('\n')
+                    report['results'].extend(best)
+    finally:
+        shutil.rmtree(inputdirectory, ignore_errors=True)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as handle:
+            json.dump(report, handle, indent=1, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if arguments.compare:
+        with open(arguments.compare) as handle:
+            previous = json.load(handle)
+        lines = compare(previous, report, arguments.threshold)
+        sys.stderr.write('\n'.join(lines) + '\n')
+        return 1 if any(line.endswith('REGRESSION') for line in lines) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
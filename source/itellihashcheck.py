@@ -0,0 +1,247 @@
+# coding: utf-8
+# itellihashcheck.py
+# Copyright 2018 iTtelligent, LLC., Kirby J. Davis (kdavis@itelligentllc.com)
+
+"""This file is part of iTelliHashCSV.
+
+    iTelliHashCSV - A Cryptographic Hashing Application for CSV Files
+    Copyright (C) 2018 iTelligent, LLC (Kirby J. Davis)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+    """
+
+
+import argparse
+import filecmp
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from itellihashbench import generate_csv
+
+# Command line tool run by the checks
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'itellihashcli.py')
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def start_cli(arguments):
+    """ Start the command line tool (itellihashcli) in a new process, see wait_cli.
+
+    :param arguments: Command line arguments.
+    :return: subprocess.Popen
+    """
+    return subprocess.Popen([sys.executable, CLI] + arguments, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def wait_cli(process):
+    """ Wait for a process started by start_cli.
+
+    :param process: subprocess.Popen
+    :return: No explicit value returned; raises CheckFailed when the tool fails.
+    """
+    errors = process.communicate()[1]
+    if process.returncode != 0:
+        raise CheckFailed('itellihashcli %s exited with %d:\n%s' % (' '.join(process.args[2:]), process.returncode,
+                                                                    errors.decode(errors='replace')))
+
+
+def run_cli(arguments):
+    """ Run the command line tool (itellihashcli) in a new process.
+
+    :param arguments: Command line arguments.
+    :return: No explicit value returned; raises CheckFailed when the tool fails.
+    """
+    wait_cli(start_cli(arguments))
+
+
+def compare_outputs(expected, actual, prefixes=None):
+    """ Compare the output files of two runs byte for byte. Run reports, which hold timings, are left out.
+
+    :param expected: Output directory of the reference run.
+    :param actual: Output directory of the checked run.
+    :param prefixes: Tuple of file name prefixes of the output files to compare, or None for all of them.
+    :return: No explicit value returned; raises CheckFailed when the output files differ.
+    """
+    def outputs(directory):
+        return sorted(name for name in os.listdir(directory) if not name.startswith('Hash_RunReport_') and
+                      (prefixes is None or name.startswith(prefixes)))
+
+    names = outputs(expected)
+    if outputs(actual) != names:
+        raise CheckFailed('%s has %s, expected %s' % (actual, outputs(actual), names))
+    match, mismatch, errors = filecmp.cmpfiles(expected, actual, names, shallow=False)
+    if mismatch or errors:
+        raise CheckFailed('%s differs from %s: %s' % (actual, expected, ', '.join(mismatch + errors)))
+
+
+def run_counters(outputdirectory, algorithm):
+    """ Counters of all stages of the run report written to an output directory (see RunReport). """
+    with open(os.path.join(outputdirectory, 'Hash_RunReport_%s.json' % algorithm)) as handle:
+        report = json.load(handle)
+    counters = {}
+    for stage in report['stages']:
+        for name, value in stage['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+    return counters
+
+
+def check_cache(paths, fields, algorithm, workdirectory):
+    """ SQLite pipeline with a persistent digest cache (used whatever the hash format) and the default pipeline
+        depth (the values are hashed on the prefetch thread): a cold and a warm run must both succeed, write the
+        same output files as a run without the cache, and the warm run must find every value in the cache.
+    """
+    common = paths + ['-f', ','.join(fields), '-a', algorithm, '-m', 'sqlite']
+    reference = os.path.join(workdirectory, 'reference')
+    run_cli(common + ['-o', reference])
+    cachepath = os.path.join(workdirectory, 'cache.db')
+    for run in ('cold', 'warm'):
+        outputdirectory = os.path.join(workdirectory, run)
+        run_cli(common + ['-o', outputdirectory, '--cache', cachepath, '--cache-mode', 'always'])
+        compare_outputs(reference, outputdirectory)
+    counters = run_counters(os.path.join(workdirectory, 'warm'), algorithm)
+    if counters.get('cache_misses') or not counters.get('cache_hits'):
+        raise CheckFailed('warm cache run: %d hits, %d misses' % (counters.get('cache_hits', 0),
+                                                                  counters.get('cache_misses', 0)))
+
+
+def check_shards(paths, fields, algorithm, workdirectory, nshards=3):
+    """ Sharded run: nshards shard processes, started at the same time against a shared shard directory, and the
+        merge of their shard map files must write the same 'mapfiles' as a single-node SQLite run.
+    """
+    common = paths + ['-f', ','.join(fields), '-a', algorithm]
+    reference = os.path.join(workdirectory, 'reference')
+    run_cli(common + ['-m', 'sqlite', '-o', reference])
+    sharddirectory = os.path.join(workdirectory, 'shards')
+    processes = [start_cli(common + ['-m', 'shard', '--shard', '%d/%d' % (shard, nshards), '--shard-dir',
+                                     sharddirectory, '-o', os.path.join(workdirectory, 'shard%d' % shard)])
+                 for shard in range(nshards)]
+    for process in processes:
+        wait_cli(process)
+    merged = os.path.join(workdirectory, 'merged')
+    run_cli(common + ['-m', 'merge-shards', '--shards', str(nshards), '--shard-dir', sharddirectory, '-o', merged])
+    mapfiles = ('Hash_MapFile_',) + tuple(field + '_MapFile_' for field in fields)
+    compare_outputs(reference, merged, mapfiles)
+
+
+def check_batches(paths, fields, algorithm, workdirectory):
+    """ Incremental runs writing their output files in batches of 1 to 3 rows, so that the duplicate rows of the
+        merge with the existing 'mapfiles' fill whole batches or cross batch boundaries: after rows are appended,
+        the output files must be the same as those of a SQLite run on the whole input file.
+    """
+    inputdirectory = os.path.join(workdirectory, 'input')
+    os.makedirs(inputdirectory)
+    path = os.path.join(inputdirectory, 'batches.csv')
+    common = [path, '-f', 'id,value', '-a', algorithm]
+    for batchsize in (1, 2, 3):
+        with open(path, 'w') as handle:
+            handle.write('id,value\n1,a\n2,b\n3,c\n')
+        outputdirectory = os.path.join(workdirectory, 'incremental%d' % batchsize)
+        run_cli(common + ['-m', 'incremental', '-o', outputdirectory, '--write-batch-size', str(batchsize)])
+        with open(path, 'a') as handle:
+            handle.write('1,a\n4,d\n')
+        run_cli(common + ['-m', 'incremental', '-o', outputdirectory, '--write-batch-size', str(batchsize)])
+        reference = os.path.join(workdirectory, 'reference%d' % batchsize)
+        run_cli(common + ['-m', 'sqlite', '-o', reference])
+        compare_outputs(reference, outputdirectory, ('Hash_MapFile_', 'Hashed_', 'id_MapFile_', 'value_MapFile_'))
+
+
+def check_engines(paths, fields, algorithm, workdirectory):
+    """ The pyarrow CSV engine must write the same output files as the pandas ('c') engine, also for a file with a
+        byte order mark, empty and repeated column names and rows with fewer values than the header, whole or in
+        chunks, in single-pass and SQLite mode.
+    """
+    inputdirectory = os.path.join(workdirectory, 'input')
+    os.makedirs(inputdirectory)
+    path = os.path.join(inputdirectory, 'engines.csv')
+    with open(path, 'w', encoding='utf-8-sig', newline='') as handle:
+        handle.write('id,x,,x\n1,a,b,c\n2,d\n3,"e\nf",g,h\n4,,,\n5,i\n6,a,b,c\n7,k,l\n')
+    common = [path, '-f', 'id,x,x.1,Unnamed: 2', '-a', algorithm]
+    for mode in ('single-pass', 'sqlite'):
+        for chunks in ([], ['--chunksize', '2']):
+            directories = {}
+            for engine in ('c', 'pyarrow'):
+                directories[engine] = os.path.join(workdirectory, '%s-%s%s' % (mode, engine, '-chunks' * bool(chunks)))
+                run_cli(common + ['-m', mode, '--csv-engine', engine, '-o', directories[engine]] + chunks)
+            compare_outputs(directories['c'], directories['pyarrow'])
+    with open(os.path.join(directories['c'], 'Hashed_engines_%s.csv' % algorithm), encoding='utf-8') as handle:
+        if handle.readline() != 'id,x,Unnamed: 2,x.1\n':
+            raise CheckFailed('unexpected header in %s' % handle.name)
+
+
+CHECKS = {'batches': check_batches, 'cache': check_cache, 'engines': check_engines, 'shards': check_shards}
+
+
+def parse_arguments(argv=None):
+    """ Command line arguments: the checks to run and the size of the generated input files.
+
+    :param argv: Arguments, or None for sys.argv[1:].
+    :return: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        description='Check the iTelliHashCSV engines end to end on generated CSV files: every check runs the '
+                    'command line tool and compares its output files byte for byte with a reference run.')
+    parser.add_argument('checks', nargs='*', metavar='CHECK',
+                        help='checks to run: %s (default: all)' % ', '.join(sorted(CHECKS)))
+    parser.add_argument('--rows', type=int, default=5000, help='rows per file (default: %(default)s)')
+    parser.add_argument('--files', type=int, default=3, help='number of files (default: %(default)s)')
+    parser.add_argument('--algorithm', default='sha512', help='hash format (default: %(default)s)')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary directory of every check')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Generate the input files and run the checks.
+
+    :param argv: Arguments, or None for sys.argv[1:].
+    :return: Exit status; 1 when a check failed.
+    """
+    arguments = parse_arguments(argv)
+    unknown = [name for name in arguments.checks if name not in CHECKS]
+    if unknown:
+        sys.stderr.write('Unknown check(s): %s\n' % ', '.join(unknown))
+        return 2
+    inputdirectory = tempfile.mkdtemp(prefix='itellihashcheck-input-')
+    failed = 0
+    try:
+        paths = []
+        for k in range(arguments.files):
+            paths.append(os.path.join(inputdirectory, 'check%d.csv' % k))
+            generate_csv(paths[-1], arguments.rows, 4, arguments.rows // 4, 12, quoting=0.05, nulls=0.02, seed=k)
+        fields = ['col0', 'col1', 'col3']
+        for name in arguments.checks or sorted(CHECKS):
+            workdirectory = tempfile.mkdtemp(prefix='itellihashcheck-%s-' % name)
+            try:
+                CHECKS[name](paths, fields, arguments.algorithm, workdirectory)
+                sys.stderr.write('%-12s ok\n' % name)
+            except CheckFailed as error:
+                failed += 1
+                sys.stderr.write('%-12s FAILED: %s\n' % (name, error))
+            finally:
+                if arguments.keep:
+                    sys.stderr.write('%-12s kept %s\n' % ('', workdirectory))
+                else:
+                    shutil.rmtree(workdirectory, ignore_errors=True)
+    finally:
+        shutil.rmtree(inputdirectory, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,280 @@
+# coding: utf-8
+# itellihashcli.py
+# Copyright 2018 iTtelligent, LLC., Kirby J. Davis (kdavis@itelligentllc.com)
+
+"""This file is part of iTelliHashCSV.
+
+    iTelliHashCSV - A Cryptographic Hashing Application for CSV Files
+    Copyright (C) 2018 iTelligent, LLC (Kirby J. Davis)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+    """
+
+
+import argparse
+import os
+import sys
+
+import csvcryptohashinglogic as chl
+from hashcompression import split_extension
+from hashinstrumentation import CProfileHook, format_duration
+
+
+def parse_arguments(argv=None):
+    """ Command line arguments for the Step 1-4 workflow of the GUI and the CSVCryptoHash settings.
+
+    :param argv: Arguments, or None for sys.argv[1:].
+    :return: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m csvcryptohashinglogic',
+        description='iTelliHashCSV - cryptographically hash selected fields/columns of CSV files. Writes a hashed '
+                    'version of every input file, a summary mapping file and a mapping file per hashed field.')
+    parser.add_argument('files', nargs='+', metavar='FILE',
+                        help='input file(s), all in the same directory and with the same file extension')
+    parser.add_argument('-a', '--algorithm', choices=sorted(chl.HASH_FORMATS), default='sha512',
+                        help='hash format (default: %(default)s)')
+    parser.add_argument('-k', '--key-file', metavar='PATH',
+                        help='file holding a secret key: use the keyed (BLAKE2) or HMAC version of the algorithm; '
+                             'one trailing line break is not part of the key')
+    parser.add_argument('-f', '--fields', action='append', required=True, metavar='FIELD[,FIELD...]',
+                        help='field(s)/column(s) to hash; may be given more than once')
+    parser.add_argument('-o', '--output-dir', metavar='DIR',
+                        help='directory for the output files (default: the directory of the input files)')
+    parser.add_argument('-d', '--delimiter', default=',', help='input file delimiter (default: %(default)r)')
+    parser.add_argument('--output-delimiter', default=',', help='output file delimiter (default: %(default)r)')
+    parser.add_argument('--quotechar', default='"', help='quote character (default: %(default)r)')
+    parser.add_argument('--whitespace', action='store_true', help='input fields are delimited by whitespace')
+    parser.add_argument('--sniff', action='store_true',
+                        help='detect the delimiter and quote character from the input files instead of using '
+                             '--delimiter and --quotechar')
+    parser.add_argument('-m', '--mode', choices=('single-pass', 'sqlite', 'incremental', 'shard', 'merge-shards'),
+                        default='single-pass',
+                        help='single-pass: hash while reading each input file once (default); sqlite: the four '
+                             'stage pipeline around a temporary SQLite database; incremental: only process rows '
+                             'appended since the last run; shard: write the shard map files of the shard given by '
+                             '--shard; merge-shards: merge the shard map files of all --shards shards into the '
+                             'mapping files')
+    parser.add_argument('--shard', metavar='K/N', help='shard mode: shard K (0 to N-1) of N')
+    parser.add_argument('--shards', type=int, metavar='N', help='merge-shards mode: number of shards')
+    parser.add_argument('--shard-dir', metavar='DIR',
+                        help='shard modes: directory of the shard map files, shared by all shards (default: the '
+                             'output directory)')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='number of worker processes (default: 1)')
+    parser.add_argument('--chunksize', type=int, help='process input files in chunks of this many rows')
+    parser.add_argument('--chunkbytes', type=int, help='process input files in chunks of about this many bytes')
+    parser.add_argument('--write-batch-size', type=int, default=100000, metavar='ROWS',
+                        help='rows per batch written to the output files (default: %(default)s)')
+    parser.add_argument('--pipeline-depth', type=int, default=2,
+                        help='chunks queued between the overlapping read, hash and write threads; 0 runs them one '
+                             'after the other (default: %(default)s)')
+    parser.add_argument('--csv-engine', choices=('c', 'mmap', 'pyarrow'), default='c',
+                        help='CSV reader (default: %(default)s)')
+    parser.add_argument('--output-format', choices=('csv', 'parquet', 'arrow'), default='csv',
+                        help='format of the output files (default: %(default)s)')
+    parser.add_argument('--output-compression', choices=('gzip', 'bz2', 'xz', 'zstd'),
+                        help='compress csv output files')
+    parser.add_argument('--cache', metavar='PATH', help='persistent plaintext -> digest cache database')
+    parser.add_argument('--cache-mode', choices=('auto', 'always'), default='auto',
+                        help='auto: only use the cache for the HMAC formats (--key-file with a format other than '
+                             'BLAKE2), for which a cache hit costs less than hashing the value (default); always: '
+                             'use it for all hash formats')
+    parser.add_argument('--progress', action='store_true', help='log the progress of the run to stderr')
+    parser.add_argument('--temp-store', choices=('auto', 'disk', 'memory'), default='auto',
+                        help='sqlite mode: keep the temporary database on disk, in memory, or in memory when it is '
+                             'estimated to fit (default: %(default)s)')
+    parser.add_argument('--scratch-dir', metavar='DIR',
+                        help='sqlite mode: directory of the temporary database (default: system temporary directory)')
+    parser.add_argument('--resume', action='store_true',
+                        help='sqlite mode: keep a checkpoint so that an interrupted run resumes when started again')
+    parser.add_argument('--profile', metavar='DIR', help='profile every stage with cProfile, writing DIR/<stage>.prof')
+    return parser.parse_args(argv)
+
+
+def read_key(data):
+    """ Secret key stored in a key file: its bytes as stored, without the one trailing line break (\\n or \\r\\n)
+        that text editors add. Any other line break bytes are part of the key.
+
+    :param data: Contents of the key file.
+    :return: Key (bytes).
+    """
+    for ending in (b'\r\n', b'\n'):
+        if data.endswith(ending):
+            return data[:-len(ending)]
+    return data
+
+
+def configure(arguments):
+    """ CSVCryptoHash set up from the command line arguments.
+
+    :param arguments: argparse.Namespace returned by parse_arguments.
+    :return: CSVCryptoHash
+    """
+    mychl = chl.CSVCryptoHash(workers=max(1, arguments.workers))
+    mychl.inputdelimiter = arguments.delimiter
+    mychl.outputdelimiter = arguments.output_delimiter
+    mychl.quotechar = arguments.quotechar
+    mychl.delim_whitespace = arguments.whitespace
+    mychl.chunksize = arguments.chunksize
+    mychl.chunkbytes = arguments.chunkbytes
+    mychl.csvengine = arguments.csv_engine
+    mychl.pipelinedepth = max(0, arguments.pipeline_depth)
+    mychl.writebatchsize = max(1, arguments.write_batch_size)
+    mychl.outputformat = arguments.output_format
+    mychl.outputcompression = arguments.output_compression
+    mychl.cachepath = arguments.cache
+    mychl.cachemode = arguments.cache_mode
+    mychl.singlepass = arguments.mode == 'single-pass'
+    mychl.incremental = arguments.mode == 'incremental'
+    mychl.checkpointing = arguments.resume
+    mychl.tempstore = arguments.temp_store
+    mychl.scratchdirectory = arguments.scratch_dir
+    if arguments.key_file:
+        with open(arguments.key_file, 'rb') as handle:
+            mychl.hashkey = read_key(handle.read())
+    mychl.identify_hash(chl.HASH_FORMATS[arguments.algorithm])
+    if arguments.profile:
+        if not os.path.isdir(arguments.profile):
+            os.makedirs(arguments.profile)
+        mychl.report.hooks.append(CProfileHook(arguments.profile))
+    return mychl
+
+
+def log_progress(info):
+    """ Progress callback that logs the progress of the run (see hashinstrumentation.Progress) to stderr. """
+    if info['totalbytes']:
+        done = '%.1f of %.1f MB' % (info['bytes'] / 1e6, info['totalbytes'] / 1e6)
+    elif info['totalrows']:
+        done = '%d of %d rows' % (info['rows'], info['totalrows'])
+    else:
+        done = '%d rows' % info['rows']
+    eta = '' if info['eta'] is None else ', about %s remaining' % format_duration(info['eta'])
+    sys.stderr.write('%s: %s, run %d%% done%s\n' % (info['stage'], done, 100 * info['runfraction'], eta))
+
+
+def main(argv=None):
+    """ Run the Step 1-4 workflow of the GUI from the command line.
+
+    :param argv: Arguments, or None for sys.argv[1:].
+    :return: Exit status.
+    """
+    arguments = parse_arguments(argv)
+    fields2hash = [field for fields in arguments.fields for field in fields.split(',') if field]
+
+    # STEP 2. The input files, as an input directory, file names and their common file extension
+    paths = [os.path.abspath(path) for path in arguments.files]
+    inputdirectory = os.path.dirname(paths[0]) + os.sep
+    filesselected = [os.path.basename(path) for path in paths]
+    fileextension = split_extension(paths[0])[1]
+    for path in paths:
+        if not os.path.isfile(path):
+            sys.stderr.write('No such input file: %s\n' % path)
+            return 2
+        if os.path.dirname(path) + os.sep != inputdirectory or split_extension(path)[1] != fileextension:
+            sys.stderr.write('Input files must be in the same directory and have the same file extension\n')
+            return 2
+    outputdirectory = os.path.abspath(arguments.output_dir) + os.sep if arguments.output_dir else inputdirectory
+    if not os.path.isdir(outputdirectory):
+        os.makedirs(outputdirectory)
+
+    try:
+        mychl = configure(arguments)
+    except ValueError as error:
+        sys.stderr.write('%s\n' % error)
+        return 2
+
+    sharddirectory = os.path.abspath(arguments.shard_dir) + os.sep if arguments.shard_dir else outputdirectory
+    if arguments.mode == 'shard':
+        try:
+            shard, nshards = [int(part) for part in (arguments.shard or '').split('/')]
+        except ValueError:
+            sys.stderr.write('--shard K/N is required in shard mode\n')
+            return 2
+        # Shards started at the same time create the shared directory concurrently
+        os.makedirs(sharddirectory, exist_ok=True)
+    if arguments.mode == 'merge-shards' and not arguments.shards:
+        sys.stderr.write('--shards N is required in merge-shards mode\n')
+        return 2
+
+    # STEP 3. The fields to hash must be in at least one of the input files
+    if arguments.sniff:
+        try:
+            mychl.detect_dialect(paths)
+        except ValueError as error:
+            sys.stderr.write('%s\n' % error)
+            return 2
+    fieldsavailable = set()
+    for path in paths:
+        fieldsavailable.update(mychl.catalog.columns(path))
+    missing = [field for field in fields2hash if field not in fieldsavailable]
+    if missing:
+        sys.stderr.write('Field(s) not found in the input files: %s\n' % ', '.join(missing))
+        return 2
+
+    # STEP 4.
+    if arguments.progress:
+        mychl.progress.callback = log_progress
+    if arguments.mode == 'shard':
+        mychl.progress.plan(['create_shard_mapfiles'])
+    elif arguments.mode == 'merge-shards':
+        mychl.progress.plan(['merge_shard_mapfiles'])
+    elif mychl.incremental:
+        mychl.progress.plan(['create_outputs_incremental'])
+    elif mychl.singlepass:
+        mychl.progress.plan(['create_outputs_single_pass'])
+    else:
+        mychl.progress.plan(['create_temp_db', 'create_summary_hash_mapfile', 'create_column_hash_mapfile',
+                             'create_hashed_version_of_input'])
+    try:
+        if arguments.mode == 'shard':
+            mychl.create_shard_mapfiles(filesselected, fields2hash, inputdirectory, sharddirectory, shard, nshards)
+        elif arguments.mode == 'merge-shards':
+            mychl.merge_shard_mapfiles(fields2hash, fileextension, sharddirectory, outputdirectory, arguments.shards)
+        elif mychl.incremental:
+            mychl.create_outputs_incremental(filesselected, fields2hash, fileextension, inputdirectory,
+                                             outputdirectory)
+        elif mychl.singlepass:
+            mychl.create_outputs_single_pass(filesselected, fields2hash, fileextension, inputdirectory,
+                                             outputdirectory)
+        else:
+            mychl.initialize_sqlite()
+            mychl.create_temp_db(filesselected, fields2hash, inputdirectory)
+            mychl.create_summary_hash_mapfile(fileextension, outputdirectory)
+            mychl.create_column_hash_mapfile(filesselected, fields2hash, fileextension, inputdirectory,
+                                             outputdirectory)
+            mychl.create_hashed_version_of_input(filesselected, fields2hash, fileextension, inputdirectory,
+                                                 outputdirectory)
+            mychl.remove_sqlite()
+    except (KeyboardInterrupt, chl.RunCancelled):
+        if mychl.runlock is not None:
+            mychl.close_sqlite()
+            sys.stderr.write('Interrupted; run the same command again to resume\n')
+        else:
+            mychl.remove_sqlite()
+            sys.stderr.write('Interrupted\n')
+        return 130
+    except ValueError as error:
+        # e.g. merging shards that are not all complete
+        sys.stderr.write('%s\n' % error)
+        return 2
+    finally:
+        mychl.close_digest_cache()
+    if arguments.mode != 'shard':
+        # Shards may run concurrently and share the output directory; the merge reports on the run
+        mychl.write_run_report(outputdirectory, files=filesselected, fields=fields2hash)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
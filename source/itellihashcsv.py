@@ -34,6 +34,8 @@ from wx.lib.itemspicker import (ItemsPicker, EVT_IP_SELECTION_CHANGED, IP_SORT_C
 from wx.lib.wordwrap import wordwrap
 
 import csvcryptohashinglogic as chl
+from hashcompression import split_extension
+from hashinstrumentation import format_duration
 import itellihashcsvimages_white as itellihashcsvimages
 
 _licenseText = "iTelliHashCSV - A Cryptographic Hashing Application for CSV Files\n" \
@@ -134,27 +136,81 @@ class WorkerThread(threading.Thread):
         self.window = window
         self.timeToQuit = threading.Event()
         self.timeToQuit.clear()
+        self.status = ""
 
     def stop(self):
         self.timeToQuit.set()
 
+    def setstatus(self, status):
+        """ Show the current step in the status bar; onprogress adds the progress to it. """
+        self.status = status
+        wx.CallAfter(self.window.statusBar.SetLabel, status)
+
+    def onprogress(self, info):
+        """ Progress callback of CSVCryptoHash (see hashinstrumentation.Progress), called from this thread. Drives
+        the gauge and shows the progress and the estimated time remaining in the status bar.
+
+        :param info: Dictionary describing the progress.
+        :return: No explicit value returned.
+        """
+        percent = int(100 * info['runfraction'])
+        label = "%s %d%% done" % (self.status, percent)
+        if info['eta'] is not None:
+            label += ", about %s remaining" % format_duration(info['eta'])
+        wx.CallAfter(self.window.gauge_progress.SetValue, percent)
+        wx.CallAfter(self.window.statusBar.SetLabel, label)
+
     def run(self):
-        wx.CallAfter(self.window.statusBar.SetLabel, "Creating temporary database... please wait...")
+        mychl.progress.callback = self.onprogress
+        # Stopping the thread (e.g. closing the window) cancels the run at its next chunk, file or field/column.
+        # The temporary database and its checkpoint are kept, so that the same run started again resumes.
+        mychl.cancelevent = self.timeToQuit
+        try:
+            self.create_outputs()
+        except chl.RunCancelled:
+            # Only a run holding the lock of its database can be resumed (see CSVCryptoHash.open_checkpoint)
+            resumable = mychl.runlock is not None
+            mychl.close_sqlite()
+            mychl.close_digest_cache()
+            self.setstatus("Cancelled. Start the same run again to resume it." if resumable else "Cancelled.")
+            return
+        self.timeToQuit.set()
+        self.window.onlongrundone()
+
+    def create_outputs(self):
+        """ Create the output files with the chosen mode (see run). """
+        if mychl.singlepass or mychl.incremental:
+            self.setstatus("Creating & writing hashed input and mapping file(s)... please wait...")
+            if mychl.incremental:
+                create_outputs = mychl.create_outputs_incremental
+            else:
+                create_outputs = mychl.create_outputs_single_pass
+            mychl.progress.plan([create_outputs.__name__])
+            create_outputs(self.window.filesselected, self.window.fields2hash, self.window.fileextension,
+                           self.window.inputdirectory, self.window.outputdirectory)
+            mychl.close_digest_cache()
+            mychl.write_run_report(self.window.outputdirectory, files=self.window.filesselected,
+                                   fields=self.window.fields2hash)
+            return
+        mychl.progress.plan(['create_temp_db', 'create_summary_hash_mapfile', 'create_column_hash_mapfile',
+                             'create_hashed_version_of_input'])
+        self.setstatus("Creating temporary database... please wait...")
         mychl.create_temp_db(self.window.filesselected, self.window.fields2hash, self.window.inputdirectory)
-        wx.CallAfter(self.window.statusBar.SetLabel, "Creating & writing summary hash mapping file... please wait...")
+        self.setstatus("Creating & writing summary hash mapping file... please wait...")
         mychl.create_summary_hash_mapfile(self.window.fileextension, self.window.outputdirectory)
-        wx.CallAfter(self.window.statusBar.SetLabel, "Creating & writing field mapping file(s)... please wait...")
+        self.setstatus("Creating & writing field mapping file(s)... please wait...")
         mychl.create_column_hash_mapfile(self.window.filesselected, self.window.fields2hash, self.window.fileextension,
                                          self.window.inputdirectory,
                                          self.window.outputdirectory)
-        wx.CallAfter(self.window.statusBar.SetLabel, "Creating & writing hashed input file(s)... please wait...")
+        self.setstatus("Creating & writing hashed input file(s)... please wait...")
         mychl.create_hashed_version_of_input(self.window.filesselected, self.window.fields2hash,
                                              self.window.fileextension,
                                              self.window.inputdirectory,
                                              self.window.outputdirectory)
         mychl.remove_sqlite()
-        self.timeToQuit.set()
-        self.window.onlongrundone()
+        mychl.close_digest_cache()
+        mychl.write_run_report(self.window.outputdirectory, files=self.window.filesselected,
+                               fields=self.window.fields2hash)
 
 
 class MainFrame(wx.Frame):
@@ -473,6 +529,9 @@ class MainFrame(wx.Frame):
         self.radioBtn_SHA512.Enable(False)
         wildcard = "CSV files (*.csv)|*.csv|" \
                    "Text files (*.txt)|*.txt|" \
+                   "Compressed CSV files (*.csv.gz;*.csv.bz2;*.csv.xz;*.csv.zst)|" \
+                   "*.csv.gz;*.csv.bz2;*.csv.xz;*.csv.zst|" \
+                   "Parquet files (*.parquet)|*.parquet|" \
                    "All files (*.*)|*.*"
         dialog1 = wx.FileDialog(self,
                                 message="Choose a comma separated value (CSV) file",
@@ -487,11 +546,13 @@ class MainFrame(wx.Frame):
                 self.inputdirectory = dialog1.GetDirectory() + '\\'
                 self.outputdirectory = self.inputdirectory
                 self.filesselected = dialog1.GetFilenames()
-                self.fileextension = os.path.splitext(dialog1.GetPath())[1]
+                self.fileextension = split_extension(dialog1.GetPath())[1]
+                # The headers of the files are read once and kept in mychl.catalog for the following steps
+                paths = [self.inputdirectory + f for f in self.filesselected]
+                self.confirm_dialect(paths)
                 self.fieldsavailable = ""
-                for f in self.filesselected:
-                    with open(f, "r") as handle:
-                        self.fieldsavailable += handle.readline()
+                for path in paths:
+                    self.fieldsavailable += ','.join(mychl.catalog.columns(path)) + '\n'
                 self.button_Step2.Enable(False)
                 self.button_Step2.SetBackgroundColour(self.unselectable)
                 self.button_Step3.Enable(True)
@@ -502,6 +563,30 @@ class MainFrame(wx.Frame):
                 self.statusBar.SetLabel(
                     "Error: Selected file contains invalid or no data. Please correct file and retry or select another file.")
 
+    def confirm_dialect(self, paths):
+        """ When the delimiter and quote character sniffed from the input files (see
+        CSVCryptoHash.sniffed_dialect) differ from the ones in use, ask the user whether to read the files with
+        them. The ones in use (by default ',' and '"') are kept unless the user confirms, so that the same files
+        are always hashed the same way.
+
+        :param paths: Paths of the input files.
+        :return: No explicit value returned.
+        """
+        try:
+            dialect = mychl.sniffed_dialect(paths)
+        except ValueError:
+            return
+        if dialect is None or dialect == (mychl.inputdelimiter, mychl.quotechar):
+            return
+        dialog = wx.MessageDialog(self,
+                                  "The selected file(s) appear to use the delimiter %r and the quote character %r "
+                                  "rather than %r and %r.\n\nRead them with %r and %r?" %
+                                  (dialect + (mychl.inputdelimiter, mychl.quotechar) + dialect),
+                                  "Input file format", wx.YES_NO | wx.NO_DEFAULT | wx.ICON_QUESTION)
+        if dialog.ShowModal() == wx.ID_YES:
+            mychl.inputdelimiter, mychl.quotechar = dialect
+        dialog.Destroy()
+
     def button_Step3OnButtonClick(self, event):
         """ STEP 3. (See ItemsPickerDialog) Present to user all fields available from the input file(s) selected
         in previous step that may be selected for hashing. Allow user to select desired fields/columns.
@@ -540,7 +625,7 @@ class MainFrame(wx.Frame):
         self.button_Step4B.SetBackgroundColour(self.unselectable)
         mychl.initialize_sqlite()
         mychl.identify_hash(self.hash2use)
-        self.gauge_progress.Pulse()
+        self.gauge_progress.SetValue(0)
         self.statusBar.SetLabel("Setting up processing thread... please wait...")
         try:
             self.count += 1
@@ -570,7 +655,7 @@ class MainFrame(wx.Frame):
         dialog2.Destroy()
         mychl.initialize_sqlite()
         mychl.identify_hash(self.hash2use)
-        self.gauge_progress.Pulse()
+        self.gauge_progress.SetValue(0)
         self.statusBar.SetLabel("Setting up processing thread... please wait...")
         try:
             self.count += 1
@@ -662,6 +747,7 @@ if __name__ == "__main__":
         mytranslation.install()
 
         mychl = chl.CSVCryptoHash()
+        mychl.checkpointing = True
         frame = MainFrame()
         app.MainLoop()
     except:
@@ -0,0 +1,49 @@
+# coding: utf-8
+# lazyimport.py
+# Copyright 2018 iTtelligent, LLC., Kirby J. Davis (kdavis@itelligentllc.com)
+
+"""This file is part of iTelliHashCSV.
+
+    iTelliHashCSV - A Cryptographic Hashing Application for CSV Files
+    Copyright (C) 2018 iTelligent, LLC (Kirby J. Davis)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+    """
+
+
+import importlib
+import importlib.util
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is only imported when one of its attributes is first used, so that importing
+    iTelliHashCSV does not pay for pandas, SQLAlchemy, pyarrow... until (and unless) they are needed. After
+    the import, attribute lookups are as fast as on the module itself.
+    """
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+
+def optional_module(name):
+    """
+    LazyModule for the module name of an optional package, or None when the package is not installed.
+    """
+    if importlib.util.find_spec(name.split('.')[0]) is None:
+        return None
+    return LazyModule(name)